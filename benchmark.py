@@ -0,0 +1,345 @@
+"""
+Benchmarks the data manager, the signal reader and the dashboard charts
+as a shift (or the journal history) grows. Runs against a local SQLite
+stand-in for the prs457 tables and the connector's conveyor tables,
+filled with synthetic cycles; charts render headless with Agg. Results go
+to a JSON report, which can be compared with an earlier one:
+
+    python benchmark.py --sizes 1000 10000 100000 --output bench.json
+    python benchmark.py --compare bench.json
+
+With --compare, benchmarks whose median time grew by more than the
+tolerance are listed and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import numpy as np
+import charts
+import press_simulation
+import smith_data as sd
+import signal_reader as sr
+from db_connection import ConnectionManager
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+APPEND_CYCLES = 200  # Cycles submitted per append run.
+DEFECT_CODES = np.arange(1, 14)  # Operator defect codes; 14 is startup and
+# 15 station off.
+DEFECT_WEIGHTS = 1 / DEFECT_CODES ** 1.2  # A few codes make up most defects.
+DEFECT_WEIGHTS /= DEFECT_WEIGHTS.sum()
+
+
+def synthetic_cycles(count, start, stations=6, cycle_time=26, seed=0):
+    """
+    Generates press cycles shaped like the floor's: cycle times around
+    cycle_time, occasional stops followed by a few startup cycles (code
+    14), stations switched off for a stretch (code 15), and per station
+    defect rates of 1-6% spread over the codes Pareto-style.
+    :param count: (Int): Cycles to generate.
+    :param start: (datetime): Time before the first stroke.
+    :return: (tuple): (good pieces, defect codes, stroke times): two
+    stations x count uint8 arrays and a datetime64 array.
+    """
+    rng = np.random.default_rng(seed)
+    gaps = rng.normal(cycle_time, 1.5, count).clip(min=23)
+    stopped = rng.random(count) < .01
+    gaps[stopped] += rng.exponential(600, stopped.sum())
+    times = (np.datetime64(start, 'us') +
+             (np.cumsum(gaps) * 1e6).astype('timedelta64[us]'))
+
+    defect = np.zeros((stations, count), dtype=np.uint8)
+    rates = rng.uniform(.01, .06, stations)
+    for station in range(stations):
+        hit = rng.random(count) < rates[station]
+        codes = rng.permutation(DEFECT_CODES)  # Each station's own Pareto.
+        defect[station, hit] = rng.choice(codes, hit.sum(), p=DEFECT_WEIGHTS)
+        for off_start in np.flatnonzero(rng.random(count) < .0005):
+            off_end = off_start + int(rng.exponential(200)) + 1
+            defect[station, off_start:off_end] = 15
+    for stop in np.flatnonzero(stopped):
+        defect[:, stop:stop + 5] = 14
+    good = (defect == 0).astype(np.uint8)
+    return good, defect, times
+
+
+def fill_journals(conn, press, good, defect, times):
+    # Bulk loads synthetic cycles into the SQLite journals.
+    stamps = times.astype(datetime).tolist()
+    conn.executemany(sd.insert_statement(press.good_table,
+                                         press.columns(press.good_table)),
+                     [row[:-1] + [sum(row[:-1]), row[-1]]
+                      for row in map(list, zip(*good.tolist(), stamps))])
+    conn.executemany(sd.insert_statement(press.defect_table,
+                                         press.columns(press.defect_table)),
+                     [list(row) for row in zip(*defect.tolist(), stamps)])
+    conn.commit()
+
+
+def timed(function, repeat):
+    # Wall time of each call, seconds.
+    seconds = []
+    for ignore in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+class Results:
+    def __init__(self):
+        self.rows = []
+
+    def add(self, name, size, seconds, items=1):
+        """
+        :param name: (Str): Benchmark name.
+        :param size: (Int): Cycles in the shift or history measured.
+        :param seconds: (list): Wall time of each run.
+        :param items: (Int): Operations per run, for the per item time.
+        """
+        median = float(np.median(seconds))
+        self.rows.append({'name': name, 'size': size,
+                          'median_s': median,
+                          'min_s': float(min(seconds)),
+                          'per_item_s': median / items,
+                          'runs': len(seconds)})
+        print('{0:<28} {1:>8} {2:>12.6f} s {3:>12.9f} s/item'
+              .format(name, size, median, median / items))
+
+
+def dashboard(data):
+    # The dashboard's charts on Agg canvases, as Main.build_charts makes
+    # them.
+    built = {'top_three': {}, 'exp_avg': {}}
+    for station in range(1, data.stations + 1):
+        built['top_three'][station] = charts.TopThreeChart()
+        built['exp_avg'][station] = charts.ExpandingAverageChart()
+    built['percent'] = charts.PercentPerformanceChart()
+    built['summary'] = charts.ProdSummaryChart()
+    for chart in all_charts(built):
+        FigureCanvasAgg(chart.fig)
+    return built
+
+
+def all_charts(built):
+    return (list(built['top_three'].values()) +
+            list(built['exp_avg'].values()) +
+            [built['percent'], built['summary']])
+
+
+def display_pass(data, built, everything=False):
+    """
+    Main.update_display without Qt: charts whose data changed are updated
+    and drawn synchronously (draw rather than draw_idle, so the render is
+    inside the timing).
+    """
+    if everything:
+        data.changes.reload()
+    points = max(chart.pixel_width() for chart in built['exp_avg'].values())
+    snapshot = data.snapshot(26, points=points)
+    drawn = []
+    for station in snapshot.changed_rankings:
+        chart = built['top_three'][station]
+        chart.update(*snapshot.top_defects[station-1])
+        drawn.append(chart)
+    for station, cycles, average in snapshot.series:
+        chart = built['exp_avg'][station]
+        chart.update(average, cycles)
+        drawn.append(chart)
+    built['percent'].update(snapshot.percent)
+    built['summary'].update(snapshot.summary)
+    drawn.extend([built['percent'], built['summary']])
+    for chart in drawn:
+        chart.fig.canvas.draw()
+    return len(drawn)
+
+
+def bench_size(results, size, repeat, workdir):
+    # With the rollup on (it's opt-in), so its cost is measured too.
+    press = sd.DEFAULT_PRESS._replace(rollup_table=sd.ROLLUP_TABLE)
+    path = os.path.join(workdir, 'journals_{0}.sqlite'.format(size))
+    setup = sqlite3.connect(path)
+    press_simulation.create_journals(setup, press)
+    start = datetime.now() - timedelta(days=60)
+    good, defect, times = synthetic_cycles(size, start, press.stations,
+                                           seed=size)
+    fill_journals(setup, press, good, defect, times)
+    setup.close()
+    first = start
+    last = times[-1].astype(datetime) + timedelta(seconds=1)
+
+    db = ConnectionManager(sqlite3.connect, path, dialect='sqlite',
+                           timeout=30, detect_types=sqlite3.PARSE_DECLTYPES,
+                           check_same_thread=False)
+    data = sd.DataManager(db, press=press)
+    data.finish_reconcile(wait=True)  # Its own read of the current shift.
+
+    # Load: stream both journals into column stores, then build the
+    # aggregates, as data_reset does for a shift.
+    stores = {}
+
+    def read():
+        stores['prod'] = data.sql_data_lists(press.good_table, first, last)
+        stores['defect'] = data.sql_data_lists(press.defect_table, first,
+                                               last)
+
+    def aggregate():
+        data.prod_lists = stores['prod']
+        data.defect_lists = stores['defect']
+
+    results.add('load_read', size, timed(read, repeat), size)
+    results.add('load_aggregates', size, timed(aggregate, repeat), size)
+
+    # In-memory queries the display makes, for every station.
+    stations = range(1, press.stations + 1)
+    results.add('top_three_all', size, timed(data.top_defects, repeat))
+    results.add('expand_average_series_all', size, timed(
+            lambda: [data.expand_average_series(s, 500) for s in stations],
+            repeat))
+    results.add('production_summary', size, timed(
+            lambda: (data.percent_production(),
+                     data.production_summary(26)), repeat))
+    data.snapshot(26)  # Takes the load's changes; then steady state.
+    results.add('snapshot', size, timed(
+            lambda: data.snapshot(26, points=500), repeat))
+
+    # Rendering: every chart, then a typical cycle's redraws.
+    built = dashboard(data)
+    results.add('render_full', size, timed(
+            lambda: display_pass(data, built, everything=True), repeat),
+            len(all_charts(built)))
+    stroke = [last]
+
+    def cycle():
+        stroke[0] += timedelta(seconds=26)
+        data.submit_cycle([1, 1, 1, 1, 1, 1], [0, 0, 0, 0, 0, 0], stroke[0])
+        display_pass(data, built)
+
+    results.add('render_cycle', size, timed(cycle, repeat))
+
+    # Appends: the per cycle in-memory path, then the time for the writer
+    # thread to commit them.
+    def append():
+        for ignore in range(APPEND_CYCLES):
+            stroke[0] += timedelta(seconds=26)
+            data.submit_cycle(good[:, 0].tolist(), defect[:, 0].tolist(),
+                              stroke[0])
+
+    def drain():
+        while data.write_depth:
+            time.sleep(.001)
+
+    results.add('append', size, timed(append, repeat), APPEND_CYCLES)
+    results.add('journal_drain', size, timed(drain, 1), APPEND_CYCLES)
+
+    # Server-side reports and the rollup over the whole history.
+    end = stroke[0] + timedelta(hours=1)
+    results.add('rollup_rebuild', size, timed(
+            lambda: sd.rebuild_rollup(db, press, first, end, 24 * 7), 1),
+            size)
+    for report in ('good_report', 'defect_report', 'cycle_report',
+                   'rollup_report'):
+        results.add(report + '_shift', size, timed(
+                lambda: getattr(data, report)(first, end, 'shift'), repeat))
+
+    data.close()
+
+
+def bench_signal(results, size, repeat, workdir):
+    # SignalReader checks against an event log of size strokes.
+    path = os.path.join(workdir, 'signal_{0}.sqlite'.format(size))
+    connector = press_simulation.SimulatedConnector(path)
+    start = datetime.now() - timedelta(days=60)
+    connector.conn.executemany("INSERT INTO conveyor_event "
+                               "(stroke_datetime) VALUES (?)",
+                               [(start + timedelta(seconds=26 * k),)
+                                for k in range(size)])
+    connector.conn.commit()
+    reader = sr.SignalReader(path, history=None)
+    results.add('signal_idle_check', size, timed(reader.new_strokes,
+                                                 repeat * 100), 1)
+    when = [datetime.now()]
+
+    def stroke():
+        when[0] += timedelta(seconds=26)
+        connector.stroke(when[0])
+        reader.new_strokes()
+
+    results.add('signal_stroke_check', size, timed(stroke, repeat * 10), 1)
+    reader.close()
+    connector.close()
+
+
+def run(sizes=DEFAULT_SIZES, repeat=3, workdir=None):
+    """
+    :param sizes: (sequence): Cycles of history to benchmark at.
+    :param repeat: (Int): Runs per timing (the median is reported).
+    :param workdir: (Str): Directory for the SQLite files. Defaults to a
+    new temporary directory.
+    :return: (dict): The report.
+    """
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='press_bench_')
+    results = Results()
+    for size in sizes:
+        bench_size(results, size, repeat, workdir)
+        bench_signal(results, size, repeat, workdir)
+    return {'created': datetime.now().isoformat(),
+            'environment': {'python': platform.python_version(),
+                            'platform': platform.platform(),
+                            'numpy': np.__version__,
+                            'matplotlib': matplotlib.__version__,
+                            'sqlite': sqlite3.sqlite_version},
+            'sizes': list(sizes),
+            'repeat': repeat,
+            'results': results.rows}
+
+
+def compare(report, baseline, tolerance=.2):
+    """
+    :param report: (dict): New report.
+    :param baseline: (dict): Earlier report.
+    :param tolerance: (Float): Allowed growth in median time.
+    :return: (list): (name, size, baseline median, new median) for each
+    benchmark that got slower than allowed.
+    """
+    before = {(row['name'], row['size']): row['median_s']
+              for row in baseline['results']}
+    slower = []
+    for row in report['results']:
+        key = (row['name'], row['size'])
+        if key in before and row['median_s'] > before[key] * (1 + tolerance):
+            slower.append(key + (before[key], row['median_s']))
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Dashboard benchmarks.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=list(DEFAULT_SIZES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmark_report.json')
+    parser.add_argument('--compare', help='Earlier report to check against.')
+    parser.add_argument('--tolerance', type=float, default=.2)
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.repeat)
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print('Report written to ' + args.output)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            slower = compare(report, json.load(baseline_file),
+                             args.tolerance)
+        for name, size, old, new in slower:
+            print('SLOWER {0} at {1}: {2:.6f} s -> {3:.6f} s'
+                  .format(name, size, old, new))
+        sys.exit(1 if slower else 0)
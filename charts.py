@@ -0,0 +1,169 @@
+import math
+from matplotlib.figure import Figure
+
+
+class Chart:
+    """
+    A dashboard chart built once. update() only changes the data of the
+    existing artists; redraw() asks the canvas for a deferred redraw, so a
+    cycle never creates figures, axes or canvases.
+    """
+    def __init__(self):
+        self.fig = Figure(frameon=False)
+        self.ax = self.fig.add_subplot(111)
+
+    def redraw(self):
+        self.fig.canvas.draw_idle()
+
+
+class TopThreeChart(Chart):
+    """
+    Bar chart of a station's three most frequent defects.
+    """
+    def __init__(self):
+        super(TopThreeChart, self).__init__()
+        self.bars = self.ax.bar(range(3), [0, 0, 0], align='center',
+                                color='darkred')
+
+    def update(self, codes, counts):
+        """
+        :param codes: (list): Defect codes, most frequent first (up to 3).
+        :param counts: (list): Count for each code.
+        :return: No return.
+        """
+        for idx, bar in enumerate(self.bars):
+            if idx < len(counts):
+                bar.set_height(counts[idx])
+                bar.set_visible(True)
+            else:
+                bar.set_height(0)
+                bar.set_visible(False)
+
+        # Order bar chart in a row, based on number of codes.
+        x_axis = range(len(counts))
+        self.ax.set_xticks(x_axis)
+        self.ax.set_xticklabels([str(code) for code in codes])
+        self.ax.set_xlim(-.5, max(len(counts), 1) - .5)
+
+        # Customized y-axis display.
+        try:
+            high_count = max(counts)
+        except ValueError:
+            high_count = 0
+        y_int = range(4)
+        if 1 <= high_count <= 10:
+            y_int = range(0, high_count + 2)
+        elif 11 <= high_count <= 100:
+            y_int = range(0, high_count + 2, math.ceil(high_count/10))
+        self.ax.set_yticks(y_int)
+        self.ax.set_ylim(0, max(y_int[-1], high_count))
+
+
+class ExpandingAverageChart(Chart):
+    """
+    Line chart of a station's expanding average production over the shift.
+    """
+    def __init__(self):
+        super(ExpandingAverageChart, self).__init__()
+        self.line, = self.ax.plot([], [], color='red')
+        self.ax.get_xaxis().set_visible(False)
+
+    def pixel_width(self):
+        # Plot area width on screen; no point drawing more points than this.
+        return max(int(self.ax.get_window_extent().width), 3)
+
+    def update(self, average, cycles=None):
+        """
+        :param average: (sequence): Expanding average points.
+        :param cycles: (sequence): Cycle index of each point, when average
+        is downsampled. Defaults to one point per cycle.
+        :return: No return.
+        """
+        if cycles is None:
+            cycles = range(len(average))
+        self.line.set_data(cycles, average)
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.ax.set_ylim(bottom=0)
+
+
+class PercentPerformanceChart(Chart):
+    """
+    Bar chart of each station's share of the press's good production.
+    """
+    def __init__(self):
+        super(PercentPerformanceChart, self).__init__()
+        self.fig.subplots_adjust(left=.03, right=.97)
+        self.bars = self.ax.bar(range(1, 7), [0] * 6, align='center',
+                                color='darkred')
+        self.ax.set_xticks([1, 2, 3, 4, 5, 6])
+
+    def update(self, prod_percents):
+        """
+        :param prod_percents: (list): Share of production, stations 1-6.
+        :return: No return.
+        """
+        for bar, percent in zip(self.bars, prod_percents):
+            bar.set_height(percent)
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.ax.set_ylim(bottom=0)
+
+
+class ProdSummaryChart(Chart):
+    """
+    Progress bar of ideal production, best-case production, actual
+    production and rejects over the shift.
+    """
+    # (facecolor, annotation text y, vertical alignment, horizontal
+    # alignment) for each bar, in drawing order.
+    LAYOUT = (('.6', -.12, 'top', 'right'),
+              ('.8', .88, 'bottom', 'right'),
+              ('.5', -.12, 'top', 'right'),
+              ('red', .88, 'bottom', 'center'),
+              ('darkred', -.12, 'top', 'center'))
+
+    def __init__(self):
+        super(ProdSummaryChart, self).__init__()
+        self.fig.subplots_adjust(top=.75, bottom=.25, right=.95, left=.05)
+        self.bars = []
+        self.labels = []
+        for color, text_y, va, ha in self.LAYOUT:
+            self.bars.append(self.ax.barh(0, 0, facecolor=color,
+                                          align='edge')[0])
+            self.labels.append(self.ax.annotate(
+                    '', (0, .5), xytext=(0, text_y), va=va, ha=ha,
+                    arrowprops=dict(arrowstyle="->")))
+        self.ax.axis('off')
+
+    def update(self, prod_data):
+        """
+        :param prod_data: (tuple): DataManager.production_summary output.
+        :return: No return.
+        """
+        try:
+            defect_percent = round((prod_data[3] - prod_data[4]) * 100 /
+                                   prod_data[3], 1)
+        except ZeroDivisionError:
+            defect_percent = 0.0
+        try:
+            prod_percent = round(prod_data[4] * 100 / prod_data[2], 1)
+        except ZeroDivisionError:
+            prod_percent = 0.0
+        texts = ("Ideal: " + str(prod_data[0]),
+                 "Ideal (w/ Breaks): " + str(prod_data[1]),
+                 "Best Case: " + str(prod_data[2]),
+                 "Defects: " + str(prod_data[3] - prod_data[4]) + " (" +
+                 str(defect_percent) + "%)",
+                 "Shift: " + str(prod_data[4]) + " (" + str(prod_percent) +
+                 "%)")
+
+        for bar, label, value, text, layout in zip(self.bars, self.labels,
+                                                   prod_data, texts,
+                                                   self.LAYOUT):
+            bar.set_width(value)
+            label.set_text(text)
+            label.xy = (value, .5)
+            label.set_position((value, layout[1]))
+
+        self.ax.set_xlim(left=0, right=prod_data[0])
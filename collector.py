@@ -0,0 +1,334 @@
+"""
+Headless cycle collector. Polls the presses' signals, keeps their shifts in
+memory and writes the journals, with no GUI in the process, so a hung,
+starved or closed dashboard can't cost a stroke. Live state is published
+over a local channel (a named pipe on Windows, a Unix socket elsewhere):
+each subscriber gets every press's shift on connecting, then each cycle as
+it is recorded. Subscribers send back the operator's entries.
+
+Run it on its own (python collector.py); the dashboard starts it if it
+isn't running. Only one runs per machine: a second exits at once, as long
+as the first holds its lock file.
+"""
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+if sys.platform == 'win32':
+    ADDRESS = r'\\.\pipe\press_collector'
+else:
+    ADDRESS = os.path.join(tempfile.gettempdir(), 'press_collector.sock')
+LOCK_PATH = os.path.join(tempfile.gettempdir(), 'press_collector.lock')
+AUTHKEY = b'press_collector'
+CONNECTOR_PATH = 'C:/smiths_micrologix_data/connector.py'
+
+# Messages published, as tuples:
+#   ('shift', press name, DataManager.shift_state(), cycle time, rolling
+#    cycle time)
+#   ('cycles', press name, [(good pieces, defect codes, stroke)...],
+#    cycle time, rolling cycle time)
+#   ('cycle_stats', press name, cycle_stats.CycleSummary)
+#   ('written', rows, seconds, cycles queued)
+#   ('failed', error message, cycles queued)
+# Commands accepted:
+#   ('next_cycle', press name, good pieces, defect codes)
+#   ('baseline', press name, station on list, startup)
+
+
+class Subscriber:
+    """
+    One connected dashboard. Messages go out through a bounded queue and a
+    sender thread of its own, so a subscriber that stops reading is dropped
+    instead of holding up the collector.
+    """
+    def __init__(self, conn, commands, max_queue=1000):
+        self.conn = conn
+        self.commands = commands
+        self.outbox = queue.Queue(max_queue)
+        self.closed = False
+        threading.Thread(target=self._send, daemon=True).start()
+        threading.Thread(target=self._receive, daemon=True).start()
+
+    def send(self, message):
+        # Never blocks. False if the subscriber was (or now is) dropped.
+        if self.closed:
+            return False
+        try:
+            self.outbox.put_nowait(message)
+            return True
+        except queue.Full:
+            self.close()
+            return False
+
+    def _send(self):
+        while not self.closed:
+            message = self.outbox.get()
+            if message is None:
+                break
+            try:
+                self.conn.send(message)
+            except (OSError, EOFError):
+                self.close()
+
+    def _receive(self):
+        while not self.closed:
+            try:
+                command = self.conn.recv()
+            except (OSError, EOFError):
+                self.close()
+                break
+            self.commands.put(command)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.outbox.put_nowait(None)
+        except queue.Full:
+            pass
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+
+
+class Collector:
+    """
+    Runs a PressEngine and publishes what it records. Everything touching
+    the engine happens on the thread calling run(); the listener and the
+    subscribers only pass messages through queues.
+    """
+    def __init__(self, engine, address=ADDRESS, authkey=AUTHKEY):
+        self.engine = engine
+        self.address = address
+        self.commands = queue.Queue()  # From subscribers.
+        self.joining = queue.Queue()  # New subscribers, awaiting state.
+        self.subscribers = []
+        self._lock = threading.Lock()  # Guards subscribers.
+        self._stopping = False
+
+        engine.on_cycles = self.cycles_recorded
+        engine.on_reload = self.publish_shift
+        engine.writer.on_written = self.journal_written
+        engine.writer.on_error = self.journal_failed
+
+        if not address.startswith('\\\\') and os.path.exists(address):
+            if serving(address, authkey):
+                raise OSError("A collector is already serving " + address)
+            os.remove(address)  # Left behind by a collector that crashed.
+        self.listener = Listener(address, authkey=authkey)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while not self._stopping:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                if self._stopping:
+                    break
+                continue  # Failed handshake; keep listening.
+            self.joining.put(Subscriber(conn, self.commands))
+
+    def publish(self, message):
+        with self._lock:
+            self.subscribers = [subscriber for subscriber in self.subscribers
+                                if subscriber.send(message)]
+
+    def shift_message(self, unit):
+        return ('shift', unit.press.name, unit.data.shift_state(),
+                unit.signal.current_cycle,
+                unit.signal.stats.rate(unit.signal.current_cycle))
+
+    def publish_shift(self, unit):
+        self.publish(self.shift_message(unit))
+
+    def stats_message(self, unit):
+        return ('cycle_stats', unit.press.name, unit.signal.stats.summary())
+
+    def cycles_recorded(self, unit, cycles):
+        self.publish(('cycles', unit.press.name, cycles,
+                      unit.signal.current_cycle,
+                      unit.signal.stats.rate(unit.signal.current_cycle)))
+        self.publish(self.stats_message(unit))
+
+    def journal_written(self, rows, seconds, depth):
+        # Runs on the writer thread; publish only queues.
+        self.engine.metrics.observe('journal_write', seconds)
+        self.publish(('written', rows, seconds, depth))
+
+    def journal_failed(self, message, depth):
+        self.publish(('failed', message, depth))
+
+    def handle_commands(self):
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            unit = self.engine.units.get(command[1])
+            if unit is None:
+                continue
+            if command[0] == 'next_cycle':
+                unit.next_cycle = (list(command[2]), list(command[3]))
+            elif command[0] == 'baseline':
+                unit.station_on = list(command[2])
+                unit.startup = bool(command[3])
+
+    def add_subscribers(self):
+        # Sent the current shifts first, so later cycles apply on top.
+        while True:
+            try:
+                subscriber = self.joining.get_nowait()
+            except queue.Empty:
+                break
+            for unit in self.engine.units.values():
+                subscriber.send(self.shift_message(unit))
+                subscriber.send(self.stats_message(unit))
+            with self._lock:
+                self.subscribers.append(subscriber)
+
+    def run(self, interval=.25, refresh_every=60):
+        """
+        Polls until stop() is called. Every press is checked each interval
+        (one PRAGMA data_version per press when nothing changed); between
+        polls it waits on the engine's signal watcher, which ends the wait
+        early when a connector writes, so a stroke is usually picked up
+        before the interval is out.
+        :param interval: (Float): Longest wait, seconds. Subscribers and
+        their commands are handled at least this often.
+        :param refresh_every: (Float): Seconds between catch-up reads of
+        rows written by other terminals. They run on the engine's pool and
+        are applied on a later pass, never holding up polling.
+        :return: No return.
+        """
+        watcher = self.engine.watcher
+        next_refresh = time.monotonic() + refresh_every
+        while not self._stopping:
+            self.add_subscribers()
+            self.handle_commands()
+            try:
+                self.engine.poll()
+                if time.monotonic() >= next_refresh:
+                    next_refresh = time.monotonic() + refresh_every
+                    self.engine.refresh()  # Only starts the reads.
+                self.engine.finish_refresh()
+            except Exception as error:
+                # Reported, and the next interval tries again; the loop
+                # only ends with stop().
+                self.journal_failed(str(error), self.engine.write_depth)
+            self.engine.metrics.maybe_export()
+            watcher.wait(interval)
+
+    def stop(self):
+        self._stopping = True
+
+    def close(self):
+        self._stopping = True
+        self.listener.close()
+        with self._lock:
+            for subscriber in self.subscribers:
+                subscriber.close()
+            self.subscribers = []
+        self.engine.close()
+        self.engine.metrics.export()
+
+
+def acquire_lock(path=LOCK_PATH):
+    """
+    Takes the lock that lets only one collector run on this machine. It is
+    held for as long as the returned file stays open, and the OS lets go of
+    it when the process exits, however that happens.
+    :param path: (Str): Lock file.
+    :return: (file): The open lock file, or None if another process holds
+    the lock.
+    """
+    lock_file = open(path, 'a')
+    try:
+        if sys.platform == 'win32':
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def serving(address=ADDRESS, authkey=AUTHKEY):
+    # True if a collector answers at address.
+    try:
+        Client(address, authkey=authkey).close()
+    except (AuthenticationError, EOFError):
+        return True  # Something is listening, just not with our key.
+    except OSError:
+        return False
+    return True
+
+
+def connect(address=ADDRESS, authkey=AUTHKEY):
+    # A subscriber connection; raises OSError if no collector is running.
+    return Client(address, authkey=authkey)
+
+
+def connector_running(path=CONNECTOR_PATH):
+    """
+    Whether some process is already running the connector script, going by
+    the command lines of the machine's processes. Windows only, as is
+    os.startfile.
+    :param path: (Str): The connector script.
+    :return: (Bool): False too if the processes couldn't be listed.
+    """
+    script = os.path.basename(path).lower()
+    command = '(Get-CimInstance Win32_Process).CommandLine'
+    try:
+        listed = subprocess.run(['powershell', '-NoProfile', '-Command',
+                                 command],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL,
+                                universal_newlines=True, timeout=30).stdout
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return any(script in line.lower() for line in listed.splitlines())
+
+
+def launch():
+    # Starts a collector process that outlives the caller.
+    script = os.path.abspath(__file__)
+    return subprocess.Popen([sys.executable, script],
+                            cwd=os.path.dirname(script))
+
+
+if __name__ == '__main__':
+    # Before anything slow, so a second collector (e.g. launched by a
+    # dashboard while this one is still starting) exits straight away.
+    lock = acquire_lock()
+    if lock is None:
+        sys.exit('A cycle collector is already running.')
+    # Imported here so the dashboard, which imports this module for
+    # connect(), doesn't load the engine and its database modules.
+    import presses
+    from press_engine import PressEngine
+    from cycle_metrics import CycleMetrics
+    from shift_cache import ShiftCache
+    tracked = presses.tracked()
+    collector = Collector(PressEngine(tracked, cache=ShiftCache(),
+                                      metrics=CycleMetrics('collector')))
+    # Only once the engine is up, and not if the connector already runs
+    # (started by hand, or by a collector before this one).
+    if (hasattr(os, 'startfile') and os.path.exists(CONNECTOR_PATH) and
+            not connector_running()):
+        os.startfile(CONNECTOR_PATH)
+    try:
+        collector.run()
+    finally:
+        collector.close()
@@ -0,0 +1,266 @@
+"""
+Stage timing for the cycle capture path. Each process times its own stages
+(the collector: reading the signal, updating the shift, publishing, and the
+writer's commits; the dashboard: mirroring the cycle and redrawing), keeps
+latency histograms, and logs the breakdown of any cycle slower than a
+threshold. Metrics are written every so often to a text file in Prometheus
+exposition format, one file per process, for node_exporter's textfile
+collector to pick up.
+
+Set PRESS_METRICS=off in the environment, or pass enabled=False, to switch
+it all off.
+"""
+import bisect
+import collections
+import os
+import threading
+import time
+from datetime import datetime
+
+METRICS_DIR = 'C:/smiths_micrologix_data/metrics'
+ENABLED = os.environ.get('PRESS_METRICS', 'on').lower() not in ('off', '0')
+
+# Histogram bucket upper bounds, seconds.
+BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+QUANTILES = (.5, .95, .99)
+
+
+class StageHistogram:
+    """
+    Latency of one stage: cumulative bucket counts since the process
+    started, plus the most recent samples for rolling quantiles.
+    """
+    def __init__(self, window):
+        self.counts = [0] * (len(BUCKETS) + 1)  # Last is +Inf.
+        self.total = 0.0
+        self.count = 0
+        self.recent = collections.deque(maxlen=window)
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+
+class CycleMetrics:
+    """
+    Times the stages of a cycle with lap(): each lap records the time since
+    start() or the previous lap under the stage's name, so a cycle costs one
+    perf_counter() call per stage. end() closes the cycle. Stages timed
+    elsewhere (e.g. on the writer thread) are added with observe().
+    """
+    def __init__(self, process, enabled=ENABLED, path=None, slow_cycle=.25,
+                 export_every=15, window=1000, slow_log=100):
+        """
+        :param process: (Str): Process name, used as a label and to name
+        the files, e.g. 'collector'.
+        :param enabled: (Bool): False makes every method a no-op.
+        :param path: (Str): Metrics file. Defaults to
+        METRICS_DIR/<process>.prom; the slow-cycle log goes alongside it.
+        :param slow_cycle: (Float): Seconds above which a cycle is logged
+        with its stage breakdown.
+        :param export_every: (Float): Seconds between metrics file writes.
+        :param window: (Int): Recent samples per stage kept for quantiles.
+        :param slow_log: (Int): Slow cycles kept in memory.
+        """
+        self.process = process
+        self.enabled = enabled
+        if path is None:
+            path = os.path.join(METRICS_DIR, process + '.prom')
+        self.path = path
+        self.slow_log_path = os.path.splitext(path)[0] + '_slow.log'
+        self.slow_cycle = slow_cycle
+        self.export_every = export_every
+        self.window = window
+
+        self.stages = collections.OrderedDict()  # name: StageHistogram
+        self.cycles = 0
+        self.slow_cycles = 0
+        self.slow = collections.deque(maxlen=slow_log)  # (when, press,
+        # seconds, [(stage, seconds)...]), newest last.
+        self._unlogged = []  # Slow cycles not yet in the log file.
+        self._lock = threading.Lock()  # observe() comes from other threads.
+        self._started = 0.0
+        self._last = 0.0
+        self._laps = []
+        self._next_export = time.monotonic() + export_every
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._started = self._last = time.perf_counter()
+        self._laps = []
+
+    def lap(self, stage):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self._laps.append((stage, now - self._last))
+        self._last = now
+
+    def end(self, press=''):
+        """
+        Records the laps since start() and the cycle's total.
+        :param press: (Str): Press name, for the slow-cycle log.
+        :return: No return.
+        """
+        if not self.enabled:
+            return
+        total = self._last - self._started
+        with self._lock:
+            for stage, seconds in self._laps:
+                self._add(stage, seconds)
+            self._add('cycle', total)
+            self.cycles += 1
+            if total >= self.slow_cycle:
+                self.slow_cycles += 1
+                entry = (datetime.now(), press, total, self._laps)
+                self.slow.append(entry)
+                self._unlogged.append(entry)
+        self._laps = []
+
+    def observe(self, stage, seconds):
+        # A stage timed outside start()/end(). Safe from any thread.
+        if not self.enabled:
+            return
+        with self._lock:
+            self._add(stage, seconds)
+
+    def _add(self, stage, seconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = StageHistogram(self.window)
+        histogram.add(seconds)
+
+    def maybe_export(self):
+        # Writes the files if export_every has passed. Call it often.
+        if not self.enabled or time.monotonic() < self._next_export:
+            return False
+        self._next_export = time.monotonic() + self.export_every
+        self.export()
+        return True
+
+    def exposition(self):
+        """
+        :return: (Str): The metrics in Prometheus text exposition format.
+        """
+        label = 'process="{0}"'.format(self.process)
+        lines = ['# HELP press_stage_seconds Time spent per cycle stage.',
+                 '# TYPE press_stage_seconds histogram']
+        with self._lock:
+            stages = [(stage, list(histogram.counts), histogram.total,
+                       histogram.count, list(histogram.recent))
+                      for stage, histogram in self.stages.items()]
+            cycles, slow_cycles = self.cycles, self.slow_cycles
+        for stage, counts, total, count, recent in stages:
+            labels = '{0},stage="{1}"'.format(label, stage)
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += bucket
+                lines.append('press_stage_seconds_bucket{{{0},le="{1}"}} '
+                             '{2}'.format(labels, bound, cumulative))
+            lines.append('press_stage_seconds_sum{{{0}}} {1:.6f}'
+                         .format(labels, total))
+            lines.append('press_stage_seconds_count{{{0}}} {1}'
+                         .format(labels, count))
+        lines += ['# HELP press_stage_recent_seconds Stage time over the '
+                  'most recent cycles.',
+                  '# TYPE press_stage_recent_seconds summary']
+        for stage, counts, total, count, recent in stages:
+            recent.sort()
+            labels = '{0},stage="{1}"'.format(label, stage)
+            for q in QUANTILES:
+                value = (recent[min(int(q * len(recent)), len(recent) - 1)]
+                         if recent else 0.0)
+                lines.append('press_stage_recent_seconds{{{0},quantile="{1}"}}'
+                             ' {2:.6f}'.format(labels, q, value))
+            lines.append('press_stage_recent_seconds_sum{{{0}}} {1:.6f}'
+                         .format(labels, sum(recent)))
+            lines.append('press_stage_recent_seconds_count{{{0}}} {1}'
+                         .format(labels, len(recent)))
+        lines += ['# HELP press_cycles_total Cycles timed.',
+                  '# TYPE press_cycles_total counter',
+                  'press_cycles_total{{{0}}} {1}'.format(label, cycles),
+                  '# HELP press_slow_cycles_total Cycles over the slow-cycle '
+                  'threshold.',
+                  '# TYPE press_slow_cycles_total counter',
+                  'press_slow_cycles_total{{{0}}} {1}'
+                  .format(label, slow_cycles)]
+        return '\n'.join(lines) + '\n'
+
+    def export(self):
+        """
+        Rewrites the metrics file (through a temporary file, so a scrape
+        never sees half of it) and appends new slow cycles to the log.
+        Failures are ignored; metrics must never stop a cycle.
+        :return: No return.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            unlogged, self._unlogged = self._unlogged, []
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as metrics_file:
+                metrics_file.write(self.exposition())
+            os.replace(temp_path, self.path)
+            if unlogged:
+                with open(self.slow_log_path, 'a') as log_file:
+                    for when, press, total, laps in unlogged:
+                        log_file.write('{0:%Y-%m-%d %H:%M:%S} {1} {2:.1f} ms: '
+                                       '{3}\n'.format(
+                                           when, press or '-', total * 1000,
+                                           ', '.join('{0} {1:.1f}'
+                                                     .format(stage,
+                                                             seconds * 1000)
+                                                     for stage, seconds
+                                                     in laps)))
+        except OSError:
+            pass
+
+
+class StartupTimer:
+    """
+    Marks through a process's startup, so the report shows where the time
+    went before the first cycle could be shown.
+    """
+    def __init__(self):
+        self.started = self._last = time.perf_counter()
+        self.steps = []  # (step, seconds), in order.
+
+    def mark(self, step):
+        # Ends a step: the time since the previous mark.
+        now = time.perf_counter()
+        self.steps.append((step, now - self._last))
+        self._last = now
+
+    @property
+    def total(self):
+        return self._last - self.started
+
+    def report(self):
+        """
+        :return: (Str): Each step's time and share of the total.
+        """
+        total = self.total or 1e-9
+        lines = ['Startup took {0:.0f} ms:'.format(self.total * 1000)]
+        for step, seconds in self.steps:
+            lines.append('  {0:<20} {1:7.0f} ms {2:4.0f}%'
+                         .format(step, seconds * 1000, 100 * seconds / total))
+        return '\n'.join(lines)
+
+    def save(self, path):
+        # Appends the report, with the time, to a log. Errors are ignored.
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, 'a') as log_file:
+                log_file.write('{0:%Y-%m-%d %H:%M:%S} {1}\n'
+                               .format(datetime.now(), self.report()))
+        except OSError:
+            pass
@@ -0,0 +1,161 @@
+import sqlite3
+from collections import namedtuple
+import numpy as np
+
+HISTORY_PATH = 'C:/smiths_micrologix_data/cycle_history.sqlite'
+
+
+class CycleSummary(namedtuple('CycleSummary', ['rate', 'median', 'p90',
+                                               'cycles', 'short', 'slow',
+                                               'stops'])):
+    """
+    The rolling cycle time (mean, median and 90th percentile of the window,
+    seconds; None until it holds a cycle) and the shift's cycle counts, as
+    the collector publishes them.
+    """
+    __slots__ = ()
+
+
+class CycleStats:
+    """
+    Rolling statistics over measured press cycle durations (time between
+    strokes). Recent running cycles sit in a fixed-size ring buffer with a
+    running total, so adding one and reading the rolling mean are O(1).
+    Every duration is also counted in a per shift histogram and classified:
+    short (below min_cycle, e.g. a double signal), slow (above max_cycle)
+    or a stop (above stop_after). Short cycles and stops stay out of the
+    rolling window so they don't drag the running rate around.
+
+    Durations can be kept in a local SQLite history table, written in
+    batches of batch rows.
+    """
+    def __init__(self, size=100, min_cycle=23, max_cycle=36, stop_after=90,
+                 max_bin=120, history=None, batch=20):
+        """
+        :param size: (Int): Cycles in the rolling window.
+        :param min_cycle: (Float): Shortest plausible cycle, seconds.
+        :param max_cycle: (Float): Longest normal cycle, seconds.
+        :param stop_after: (Float): Gap treated as a stop, seconds.
+        :param max_bin: (Int): Histogram covers 0 to max_bin seconds in
+        one second bins; the last bin also holds anything longer.
+        :param history: (Str): SQLite file for the duration history, or
+        None to keep none.
+        :param batch: (Int): History rows per insert.
+        """
+        self.min_cycle = min_cycle
+        self.max_cycle = max_cycle
+        self.stop_after = stop_after
+        self.batch = batch
+
+        self.window = np.zeros(size)
+        self.count = 0  # Filled slots in the window.
+        self.index = 0  # Next slot to write.
+        self.total = 0.0  # Sum of the filled slots.
+
+        self.histogram = np.zeros(max_bin + 1, dtype=np.int64)
+        self.reset_shift()
+
+        self.history = None
+        self.pending = []  # History rows not yet inserted.
+        if history is not None:
+            self.history = sqlite3.connect(
+                    history, detect_types=sqlite3.PARSE_DECLTYPES)
+            self.history.execute("CREATE TABLE IF NOT EXISTS cycle_history ("
+                                 "stroke_datetime TIMESTAMP, "
+                                 "duration REAL, "
+                                 "kind TEXT)")
+            self.history.commit()
+
+    def reset_shift(self):
+        # Clears the shift counts; the rolling window carries on.
+        self.histogram[:] = 0
+        self.cycles = 0
+        self.short = 0
+        self.slow = 0
+        self.stops = 0
+
+    def add(self, duration, stroke=None):
+        """
+        Records one measured cycle.
+        :param duration: (Float): Seconds since the previous stroke.
+        :param stroke: (datetime): Time of the stroke, for the history.
+        :return: (Str): 'short', 'normal', 'slow' or 'stop'.
+        """
+        self.cycles += 1
+        self.histogram[min(int(duration), len(self.histogram) - 1)] += 1
+        if duration > self.stop_after:
+            self.stops += 1
+            kind = 'stop'
+        elif duration < self.min_cycle:
+            self.short += 1
+            kind = 'short'
+        else:
+            if duration > self.max_cycle:
+                self.slow += 1
+                kind = 'slow'
+            else:
+                kind = 'normal'
+            if self.count == len(self.window):
+                self.total -= self.window[self.index]
+            else:
+                self.count += 1
+            self.window[self.index] = duration
+            self.total += duration
+            self.index = (self.index + 1) % len(self.window)
+
+        if self.history is not None:
+            self.pending.append((stroke, duration, kind))
+            if len(self.pending) >= self.batch:
+                self.flush_history()
+        return kind
+
+    def rate(self, default=None):
+        # Rolling mean cycle time, seconds.
+        if not self.count:
+            return default
+        return self.total / self.count
+
+    def values(self):
+        # Window contents, oldest first.
+        if self.count < len(self.window):
+            return self.window[:self.count].copy()
+        return np.roll(self.window, -self.index)
+
+    def percentile(self, q):
+        """
+        :param q: (Float or sequence): Percentile(s), 0-100.
+        :return: Rolling percentile(s) of the window, or None if empty.
+        """
+        if not self.count:
+            return None
+        return np.percentile(self.window[:self.count], q)
+
+    def summary(self):
+        """
+        :return: (CycleSummary): The rolling figures and the shift's counts.
+        """
+        median = p90 = None
+        if self.count:
+            median, p90 = self.percentile((50, 90)).tolist()
+        return CycleSummary(self.rate(), median, p90, self.cycles,
+                            self.short, self.slow, self.stops)
+
+    def distribution(self):
+        """
+        The shift's cycle time distribution.
+        :return: (tuple): (bin start seconds, cycles in each bin).
+        """
+        return np.arange(len(self.histogram)), self.histogram.copy()
+
+    def flush_history(self):
+        if self.history is None or not self.pending:
+            return
+        self.history.executemany("INSERT INTO cycle_history "
+                                 "VALUES (?, ?, ?)", self.pending)
+        self.history.commit()
+        self.pending = []
+
+    def close(self):
+        if self.history is not None:
+            self.flush_history()
+            self.history.close()
@@ -0,0 +1,176 @@
+import threading
+import time
+
+
+class DatabaseUnavailable(Exception):
+    """
+    Raised when no connection can be made (or the manager is still backing
+    off after a failed attempt).
+    """
+    pass
+
+
+class ConnectionManager:
+    """
+    Shared database connection handling for the app. Connections are opened
+    lazily, one per thread (pyodbc connections shouldn't be shared between
+    threads), and checked with a cheap ping after sitting idle. A dropped
+    connection is reopened on next use; failed connects back off
+    exponentially so a down server isn't hammered. Cursors are cached per
+    thread and key, so repeating the same statement on the same cursor reuses
+    its prepared plan.
+
+    Any DB-API module works, e.g. ConnectionManager(pyodbc.connect, conn_str)
+    in production or ConnectionManager(sqlite3.connect, ':memory:',
+    dialect='sqlite') locally.
+    """
+    def __init__(self, connect, *args, ping='SELECT 1', dialect='mssql',
+                 check_after=30, min_backoff=1, max_backoff=60, **kwargs):
+        """
+        :param connect: (callable): DB-API connect function.
+        :param args: Positional arguments for connect.
+        :param ping: (Str): Cheap statement used as a liveness check.
+        :param dialect: (Str): SQL dialect of the server, 'mssql' or
+        'sqlite', for statements that differ between them.
+        :param check_after: (Float): Idle seconds before a connection is
+        pinged on its next use.
+        :param min_backoff: (Float): First reconnect delay, seconds.
+        :param max_backoff: (Float): Longest reconnect delay, seconds.
+        :param kwargs: Keyword arguments for connect.
+        """
+        self._connect_fn = connect
+        self._args = args
+        self._kwargs = kwargs
+        self.ping = ping
+        self.dialect = dialect
+        self.check_after = check_after
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open = []  # Every live connection, for close().
+        self._backoff = min_backoff
+        self._retry_at = 0.0
+        self.reconnects = 0
+
+    def _state(self):
+        state = self._local
+        if not hasattr(state, 'conn'):
+            state.conn = None
+            state.cursors = {}
+            state.last_used = 0.0
+        return state
+
+    def _connect(self):
+        with self._lock:
+            wait = self._retry_at - time.monotonic()
+            if wait > 0:
+                raise DatabaseUnavailable('reconnect backing off, next try in '
+                                          '{0:.1f} s'.format(wait))
+        try:
+            conn = self._connect_fn(*self._args, **self._kwargs)
+        except Exception as error:
+            with self._lock:
+                self._retry_at = time.monotonic() + self._backoff
+                self._backoff = min(self._backoff * 2, self.max_backoff)
+            raise DatabaseUnavailable(str(error)) from error
+        with self._lock:
+            self._backoff = self.min_backoff
+            self._retry_at = 0.0
+            self._open.append(conn)
+        return conn
+
+    def _alive(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.ping)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def connection(self):
+        """
+        The calling thread's connection, opened or reopened as needed.
+        :return: DB-API connection.
+        """
+        state = self._state()
+        now = time.monotonic()
+        if (state.conn is not None and
+                now - state.last_used > self.check_after and
+                not self._alive(state.conn)):
+            self.invalidate()
+        if state.conn is None:
+            state.conn = self._connect()
+            if state.last_used:
+                self.reconnects += 1
+        state.last_used = now
+        return state.conn
+
+    def cursor(self, key=None):
+        """
+        A cached cursor on the calling thread's connection.
+        :param key: Cache key, usually the statement the cursor is used for.
+        :return: DB-API cursor.
+        """
+        conn = self.connection()
+        state = self._state()
+        cursor = state.cursors.get(key)
+        if cursor is None:
+            cursor = state.cursors[key] = conn.cursor()
+        return cursor
+
+    def execute(self, sql, params=(), key=None):
+        """
+        Runs a read statement on a cached cursor, reconnecting and retrying
+        once if the connection turns out to be dead. Not for writes, where a
+        blind retry could duplicate rows.
+        :return: The cursor, ready to fetch from.
+        """
+        if key is None:
+            key = sql
+        for attempt in (0, 1):
+            cursor = self.cursor(key)
+            try:
+                cursor.execute(sql, params)
+                return cursor
+            except Exception:
+                if attempt or self.check():
+                    raise
+
+    def check(self):
+        """
+        Pings the calling thread's connection, dropping it if dead.
+        :return: (Bool): True if the connection is usable.
+        """
+        state = self._state()
+        if state.conn is not None and self._alive(state.conn):
+            state.last_used = time.monotonic()
+            return True
+        self.invalidate()
+        return False
+
+    def invalidate(self):
+        # Drops the calling thread's connection; the next use reconnects.
+        state = self._state()
+        conn, state.conn, state.cursors = state.conn, None, {}
+        if conn is not None:
+            with self._lock:
+                if conn in self._open:
+                    self._open.remove(conn)
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def close(self):
+        with self._lock:
+            conns, self._open = self._open, []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._local = threading.local()
@@ -0,0 +1,333 @@
+import collections
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class JournalBuffer:
+    """
+    Write-behind buffer for the production journals. Rows are queued per
+    INSERT statement and written together, with every queued row for every
+    table inside a single transaction. Normally that is one transaction per
+    cycle (good row + defect row); when the server is slow the batch limit
+    grows so several cycles go out in one executemany per table.
+
+    Rows are only dropped from the buffer once the commit has returned, and a
+    failed flush is rolled back, so retrying neither loses nor duplicates
+    rows. The exception is a statement that fails while the connection is
+    still healthy (a bad row, a changed table): retrying it would block
+    every row behind it forever, so its rows are logged and moved to
+    quarantined instead.
+    """
+    def __init__(self, db, max_cycles=1, max_batch=20, max_age=30,
+                 slow_flush=2):
+        """
+        :param db: (ConnectionManager): Shared connection manager.
+        :param max_cycles: (Int): Cycles to hold before flushing when the
+        server is responsive.
+        :param max_batch: (Int): Upper limit the batch size grows to while
+        the server is slow.
+        :param max_age: (Float): Seconds the oldest queued row may wait.
+        :param slow_flush: (Float): Flush time (seconds) above which the
+        server is treated as slow.
+        """
+        self.db = db
+        self.max_cycles = max_cycles
+        self.max_batch = max_batch
+        self.max_age = max_age
+        self.slow_flush = slow_flush
+
+        # lock guards the queued rows and is never held during database I/O.
+        # flush_lock is held for a whole flush, so holding it guarantees no
+        # rows move from the buffer to the server in the meantime.
+        self.lock = threading.RLock()
+        self.flush_lock = threading.Lock()
+
+        self.batch_limit = max_cycles
+        self.pending = {}  # INSERT statement: list of row tuples.
+        self.cycles = 0  # Cycles queued since the last good flush.
+        self.oldest = None  # time.monotonic() of the oldest queued row.
+        self.last_flush_time = 0.0
+        self.last_error = None
+        self.quarantined = []  # (statement, rows, error) set aside.
+        self.commits = collections.Counter()  # Statement: flushes that
+        # committed rows of it, so readers can tell if any landed meanwhile.
+        self.additive = set()  # Statements whose rows add their last value
+        # to the row keyed by the others (the rollup upserts): a flush sums
+        # each key's values and sends one row per key.
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(rows) for rows in self.pending.values())
+
+    def add(self, statement, row):
+        with self.lock:
+            self.pending.setdefault(statement, []).append(tuple(row))
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+
+    def add_cycle(self, rows):
+        """
+        Queues the journal rows of one cycle.
+        :param rows: (list): (statement, row) pairs.
+        :return: No return.
+        """
+        with self.lock:
+            for statement, row in rows:
+                self.add(statement, row)
+            self.cycles += 1
+
+    def due(self):
+        with self.lock:
+            if not self.pending:
+                return False
+            if self.cycles >= self.batch_limit:
+                return True
+            return time.monotonic() - self.oldest >= self.max_age
+
+    def maybe_flush(self):
+        if self.due():
+            self.flush()
+            return True
+        return False
+
+    def rows(self, statement):
+        # Rows still waiting to be written for one statement.
+        with self.lock:
+            return list(self.pending.get(statement, []))
+
+    def flush(self):
+        """
+        Writes everything queued in one transaction.
+        :return: (Int): Rows written. 0 if nothing was pending or the flush
+        failed (the rows stay queued for the next attempt, except those of a
+        statement the server rejected, which are quarantined).
+        """
+        with self.flush_lock:
+            with self.lock:
+                batch = {statement: list(rows)
+                         for statement, rows in self.pending.items()}
+                cycles = self.cycles
+            if not batch:
+                return 0
+            start = time.monotonic()
+            conn = None
+            failing = None  # Statement being executed when it failed.
+            try:
+                conn = self.db.connection()
+                # One cached cursor per statement keeps each prepared.
+                for statement, rows in batch.items():
+                    failing = statement
+                    cursor = self.db.cursor(statement)
+                    if statement in self.additive:
+                        rows = self.sum_rows(rows)
+                    if len(rows) == 1:
+                        cursor.execute(statement, rows[0])
+                    else:
+                        cursor.executemany(statement, rows)
+                failing = None
+                conn.commit()
+            except Exception as error:
+                self.last_error = error
+                if conn is not None:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+                    # Drops the connection if the error was the link going
+                    # down, so the retry reconnects. Still healthy means the
+                    # server rejected the statement itself.
+                    if self.db.check() and failing is not None:
+                        self._quarantine(failing, batch[failing], error)
+                        return 0
+                # Back off to a full batch so a down server isn't hit every
+                # cycle.
+                with self.lock:
+                    self.batch_limit = self.max_batch
+                return 0
+
+            self.last_flush_time = time.monotonic() - start
+            self.last_error = None
+            written = 0
+            with self.lock:
+                for statement, rows in batch.items():
+                    del self.pending[statement][:len(rows)]
+                    if not self.pending[statement]:
+                        del self.pending[statement]
+                    written += len(rows)
+                    self.commits[statement] += 1
+                self.cycles -= cycles
+                self.oldest = time.monotonic() if self.pending else None
+
+                if self.last_flush_time > self.slow_flush:
+                    self.batch_limit = min(self.batch_limit * 2,
+                                           self.max_batch)
+                else:
+                    self.batch_limit = self.max_cycles
+            return written
+
+    @staticmethod
+    def sum_rows(rows):
+        """
+        Folds rows with the same key (every value but the last) into one,
+        adding up their last values.
+        :param rows: (list): Row tuples.
+        :return: (list): One row per key, in order of first appearance.
+        """
+        sums = collections.OrderedDict()
+        for row in rows:
+            key = tuple(row[:-1])
+            sums[key] = sums.get(key, 0) + row[-1]
+        return [key + (value,) for key, value in sums.items()]
+
+    def _quarantine(self, statement, rows, error):
+        # Sets a rejected statement's rows aside so the rest can be written.
+        log.error("Journal rows quarantined after %s: %s %r",
+                  error, statement, rows)
+        with self.lock:
+            del self.pending[statement][:len(rows)]
+            if not self.pending[statement]:
+                del self.pending[statement]
+            if not self.pending:
+                self.cycles = 0
+                self.oldest = None
+            self.quarantined.append((statement, rows, str(error)))
+
+
+class JournalWriter(threading.Thread):
+    """
+    Worker thread that writes the journal buffer on its own connection (the
+    connection manager keeps one per thread). The GUI hands
+    it whole cycles through a bounded queue and never waits on the database;
+    results and errors are reported through the on_written/on_error
+    callbacks, which run on the worker thread.
+
+    With a spool, rows still uncommitted when the writer stops (the server
+    being down, say) are saved to it, and queued again first thing by the
+    next writer; they are only dropped from the spool once a flush with
+    them in it has committed. Quarantined rows are kept in the spool too,
+    for someone to look at.
+    """
+    def __init__(self, buffer, maxsize=500, poll=1.0, spool=None):
+        """
+        :param buffer: (JournalBuffer): Buffer (and connection) to write with.
+        :param maxsize: (Int): Cycles the hand-off queue will hold.
+        :param poll: (Float): Seconds between age-limit checks when idle.
+        :param spool: (ShiftCache): Local file for rows left unsent at
+        shutdown, or None to keep none.
+        """
+        super(JournalWriter, self).__init__(name='JournalWriter')
+        self.daemon = True
+        self.buffer = buffer
+        self.maxsize = maxsize
+        self.poll = poll
+        self.on_written = None  # callable(rows written, seconds, depth)
+        self.on_error = None  # callable(message, depth)
+
+        self._items = collections.deque()
+        # Shares the buffer's lock so a cycle is always either in the queue
+        # or in the buffer, never in between.
+        self._ready = threading.Condition(buffer.lock)
+        self._stopping = False
+        self.spool = spool
+        self._restored = False  # Spooled rows not yet committed.
+        if spool is not None:
+            restored = spool.load_unsent()
+            if restored:
+                self._items.append(restored)
+                self._restored = True
+
+    def submit(self, rows, force=False):
+        """
+        Queues one cycle for writing. Never blocks.
+        :param rows: (list): (statement, row) pairs for the cycle.
+        :param force: (Bool): Take it even if the queue is full, as when
+        handing over everything at shutdown.
+        :return: (Bool): False if the queue is full and the cycle was not
+        taken.
+        """
+        with self._ready:
+            if len(self._items) >= self.maxsize and not force:
+                return False
+            self._items.append(list(rows))
+            self._ready.notify()
+            return True
+
+    @property
+    def depth(self):
+        # Cycles handed over but not yet committed.
+        with self._ready:
+            return len(self._items) + self.buffer.cycles
+
+    def pending_rows(self, statement):
+        """
+        Rows for one statement that have been handed over but not committed.
+        Hold buffer.flush_lock around this and the matching server read to
+        get a view with no gaps or overlaps.
+        """
+        with self._ready:
+            rows = self.buffer.rows(statement)
+            for cycle in self._items:
+                rows.extend(tuple(row) for row_statement, row in cycle
+                            if row_statement == statement)
+            return rows
+
+    def unsent(self):
+        # Every (statement, row) pair handed over but not committed.
+        with self._ready:
+            rows = [(statement, row)
+                    for statement, rows in self.buffer.pending.items()
+                    for row in rows]
+            for cycle in self._items:
+                rows.extend(cycle)
+            return rows
+
+    def run(self):
+        while True:
+            with self._ready:
+                self._ready.wait_for(lambda: self._items or self._stopping,
+                                     timeout=self.poll)
+                while self._items:
+                    self.buffer.add_cycle(self._items.popleft())
+                stopping = self._stopping
+            if self.buffer.due() or stopping:
+                self._flush()
+            if stopping:
+                break
+
+    def _flush(self):
+        written = self.buffer.flush()
+        with self._ready:
+            quarantined = self.buffer.quarantined
+            self.buffer.quarantined = []
+        if self.spool is not None:
+            for statement, rows, error in quarantined:
+                self.spool.save_quarantined(statement, rows, error)
+        if self._restored and (written or quarantined):
+            self.spool.save_unsent([])  # No longer only in the spool.
+            self._restored = False
+        if self.buffer.last_error is not None:
+            if self.on_error is not None:
+                self.on_error(str(self.buffer.last_error), self.depth)
+        elif written:
+            if self.on_written is not None:
+                self.on_written(written, self.buffer.last_flush_time,
+                                self.depth)
+
+    def stop(self, timeout=10):
+        """
+        Wakes the worker for a last flush and waits for it to finish, then
+        saves whatever is still uncommitted to the spool.
+        :param timeout: (Float): Seconds to wait for the last flush.
+        :return: (Int): Rows left unsent.
+        """
+        with self._ready:
+            self._stopping = True
+            self._ready.notify()
+        self.join(timeout)
+        unsent = self.unsent()
+        if self.spool is not None:
+            self.spool.save_unsent(unsent)
+        return len(unsent)
@@ -0,0 +1,245 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import smith_data as sd
+import signal_reader as sr
+from journal_buffer import JournalBuffer, JournalWriter
+from db_connection import ConnectionManager
+from cycle_metrics import CycleMetrics
+
+
+class PressUnit:
+    """
+    One press inside the engine: its data manager, its signal reader and
+    what a stroke records without operator input (as on the dashboard:
+    every piece good, except stations switched off, or startup). The
+    operator's entry for the next stroke, if any, is held in next_cycle.
+    """
+    def __init__(self, press, data, signal):
+        self.press = press
+        self.data = data
+        self.signal = signal
+        self.station_on = [True] * press.stations
+        self.startup = False
+        self.next_cycle = None  # (good pieces, defect codes) from the
+        # operator, used for the next stroke only.
+
+    def baseline_cycle(self):
+        """
+        :return: (tuple): (good pieces, defect codes) per station.
+        """
+        if self.startup:
+            return [0] * self.press.stations, [14] * self.press.stations
+        return ([1 if on else 0 for on in self.station_on],
+                [0 if on else 15 for on in self.station_on])
+
+    def take_cycles(self, strokes):
+        """
+        Values for each stroke: the operator's entry goes with the first,
+        any further (missed) strokes get the baseline.
+        :param strokes: (list): Stroke datetimes, oldest first.
+        :return: (list): (good pieces, defect codes, stroke) per stroke.
+        """
+        baseline = self.baseline_cycle()
+        first, self.next_cycle = self.next_cycle or baseline, None
+        return ([(list(first[0]), list(first[1]), strokes[0])] +
+                [(baseline[0], baseline[1], stroke)
+                 for stroke in strokes[1:]])
+
+
+class PressEngine:
+    """
+    Tracks many presses in one process. Every press's data manager shares
+    one connection manager, one journal writer thread (so every press's
+    rows go out together, one transaction per flush) and one thread pool
+    for server reads. Per press there is only the in-memory shift and a
+    signal reader, so polling costs one PRAGMA read per press when nothing
+    has changed.
+    """
+    def __init__(self, presses, db=None, cache=None, workers=4,
+                 metrics=None):
+        """
+        :param presses: (list): Press entries to track (see presses.py).
+        :param db: (ConnectionManager): Shared server connections. Defaults
+        to the production server.
+        :param cache: (ShiftCache): Optional local cache, shared by all the
+        presses (entries are per journal table), which also keeps each
+        press's place in its stroke log.
+        :param workers: (Int): Threads for server reads.
+        :param metrics: (CycleMetrics): Stage timing for recorded strokes.
+        Defaults to one for the 'engine' process, on unless switched off.
+        """
+        if db is None:
+            import pyodbc  # Only needed here; simulations pass their own db.
+            db = ConnectionManager(pyodbc.connect, sd.CONNECTION_STRING)
+        self.db = db
+        self.cache = cache
+        self.writer = JournalWriter(JournalBuffer(db),
+                                    maxsize=500 * max(len(presses), 1),
+                                    spool=cache)
+        self.journal = self.writer.buffer
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        if metrics is None:
+            metrics = CycleMetrics('engine')
+        self.metrics = metrics
+        self.on_cycles = None  # callable(unit, cycles) after strokes are
+        # recorded.
+        self.on_reload = None  # callable(unit) after a press's shift is
+        # reloaded from the server.
+        self.units = collections.OrderedDict()  # press name: PressUnit
+        self._refreshes = {}  # press name: (future, shift, commits) of a
+        # refresh read not yet applied; see finish_refresh.
+        for press in presses:
+            data = sd.DataManager(db, cache, press, self.writer, self.pool)
+            last_event_id = None
+            if cache is not None:
+                last_event_id = cache.load_event_id(press.signal_path)
+            signal = sr.SignalReader(press.signal_path,
+                                     history=press.history_path,
+                                     last_event_id=last_event_id)
+            self.units[press.name] = PressUnit(press, data, signal)
+        # Warm start reads run on the pool side by side; poll applies each
+        # one once it is done.
+        self.watcher = sr.SignalWatcher(
+                {name: unit.signal for name, unit in self.units.items()})
+        # Wakes the caller when a connector writes; see poll's names.
+
+    def poll(self, names=None):
+        """
+        Checks the presses' signals once and records any strokes, with the
+        operator's entry or the press's baseline values. A warm start's
+        server catch-up is applied as soon as it has been read; strokes
+        recorded before then are kept by apply_delta's pending row merge.
+        :param names: (iterable): Only check these presses, e.g. those
+        self.watcher.wait() reported. Defaults to all of them.
+        :return: (Int): Strokes recorded across all presses.
+        """
+        if names is not None:
+            names = set(names)
+        metrics = self.metrics
+        recorded = 0
+        for name, unit in self.units.items():
+            self.reconcile(unit)
+            if names is not None and name not in names:
+                unit.data.send_backlog()
+                continue
+            metrics.start()
+            strokes = unit.signal.new_strokes()
+            if not strokes:
+                unit.data.send_backlog()
+                continue
+            unit.signal.update_cycle()
+            metrics.lap('signal_read')
+            cycles = unit.take_cycles(strokes)
+            unit.data.submit_cycles(cycles)  # Only queues the rows.
+            if self.cache is not None:
+                self.cache.save_event_id(unit.press.signal_path,
+                                         unit.signal.last_event_id)
+            metrics.lap('shift_update')
+            recorded += len(strokes)
+            if self.on_cycles is not None:
+                self.on_cycles(unit, cycles)
+                metrics.lap('publish')
+            metrics.end(unit.press.name)
+            if unit.data.shift != unit.data.current_shift():
+                unit.data.data_reset()
+                unit.signal.stats.reset_shift()
+                if self.on_reload is not None:
+                    self.on_reload(unit)
+        return recorded
+
+    def reconcile(self, unit):
+        # Applies the press's warm start catch-up if the read has finished.
+        try:
+            reloaded = unit.data.finish_reconcile()
+        except Exception:
+            return  # The writer is running; refresh catches up later.
+        if reloaded and self.on_reload is not None:
+            self.on_reload(unit)
+
+    def refresh(self):
+        """
+        Starts catching every press up with rows written elsewhere. The
+        reads run on the pool and finish_refresh applies them, so this never
+        waits on the server. Presses still reading, or with a catch-up of
+        their own pending (see DataManager.data_reset), are left alone.
+        :return: (Int): Reads started.
+        """
+        started = 0
+        for name, unit in self.units.items():
+            if name in self._refreshes or unit.data._reconcile is not None:
+                continue
+            self._read(name, unit)
+            started += 1
+        return started
+
+    def _read(self, name, unit):
+        self._refreshes[name] = (self.pool.submit(unit.data.fetch_delta),
+                                 unit.data.shift, self._commits(unit))
+
+    def _commits(self, unit):
+        # Changes whenever the writer commits rows of the press.
+        commits = self.journal.commits
+        return commits[unit.data.good_insert], \
+            commits[unit.data.defect_insert]
+
+    def finish_refresh(self):
+        """
+        Applies the refresh reads that are done, if flush_lock is free;
+        otherwise they wait for the next call, so the polling thread never
+        waits on a flush. Holding the lock, every row of a press is either
+        on the server or pending. A read the writer committed rows of the
+        press during is started again instead, as those rows would be
+        neither read nor pending.
+        :return: (Int): Server rows applied. A failed read's error is
+        raised once the rest are applied.
+        """
+        done = [name for name, (future, shift, commits)
+                in self._refreshes.items() if future.done()]
+        if not done or not self.journal.flush_lock.acquire(blocking=False):
+            return 0
+        error = None
+        reloaded = []
+        read = 0
+        try:
+            for name in done:
+                future, shift, commits = self._refreshes.pop(name)
+                unit = self.units[name]
+                if (unit.data.shift != shift or
+                        unit.data._reconcile is not None):
+                    continue  # New shift; data_reset's read covers it.
+                if future.exception() is not None:
+                    error = future.exception()
+                elif commits != self._commits(unit):
+                    self._read(name, unit)
+                else:
+                    rows = future.result()
+                    applied = unit.data.apply_delta(rows)
+                    read += applied
+                    if applied:
+                        reloaded.append(unit)
+        finally:
+            self.journal.flush_lock.release()
+        if self.on_reload is not None:
+            for unit in reloaded:
+                self.on_reload(unit)
+        if error is not None:
+            raise error
+        return read
+
+    @property
+    def write_depth(self):
+        # Cycles recorded in memory but not yet committed, all presses.
+        return self.writer.depth + sum(len(unit.data._backlog)
+                                       for unit in self.units.values())
+
+    def close(self):
+        self.watcher.close()
+        for unit in self.units.values():
+            unit.data.close()
+            unit.signal.close()
+        if self.writer.ident is not None:
+            self.writer.stop()
+        self.pool.shutdown()
+        self.db.close()
+        if self.cache is not None:
+            self.cache.close()
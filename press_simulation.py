@@ -0,0 +1,148 @@
+"""
+Runs the press engine against dozens of simulated presses, all local:
+journals go to one SQLite file standing in for the server and each press
+gets its own signal database, fed strokes the way its connector would.
+Prints how long a poll takes per press, with and without strokes, so
+per-press overhead can be checked as the press count grows.
+"""
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+import presses
+from db_connection import ConnectionManager
+from press_engine import PressEngine
+
+EVENT_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'sql', 'conveyor_event.sql')
+
+
+def create_journals(conn, press):
+    # SQLite versions of the press's two journal tables and its rollup.
+    for table in (press.good_table, press.defect_table):
+        columns = press.columns(table)
+        conn.execute("CREATE TABLE IF NOT EXISTS {0} ("
+                     "id INTEGER PRIMARY KEY AUTOINCREMENT, {1}, "
+                     "submit_datetime TIMESTAMP)"
+                     .format(table, ', '.join(column + ' INTEGER'
+                                              for column in columns[:-1])))
+    if press.rollup_table:
+        conn.execute("CREATE TABLE IF NOT EXISTS {0} ("
+                     "hour_start TIMESTAMP, station INTEGER, "
+                     "defect_code INTEGER, pieces INTEGER, "
+                     "PRIMARY KEY (hour_start, station, defect_code))"
+                     .format(press.rollup_table))
+    conn.commit()
+
+
+class SimulatedConnector:
+    """
+    Writes a press's signal database like the connector does: both
+    conveyor_signal rows, with sql/conveyor_event.sql's trigger logging a
+    conveyor_event row per stroke.
+    """
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path,
+                                    detect_types=sqlite3.PARSE_DECLTYPES)
+        now = datetime.now()
+        self.conn.execute("CREATE TABLE IF NOT EXISTS conveyor_signal ("
+                          "ID INTEGER, seconds REAL, changed TIMESTAMP)")
+        self.conn.executemany("INSERT INTO conveyor_signal VALUES (?, ?, ?)",
+                              [(0, 10.0, now), (1, 16.0, now)])
+        with open(EVENT_SQL) as event_sql:
+            self.conn.executescript(event_sql.read())
+        self.conn.commit()
+
+    def stroke(self, when):
+        self.conn.execute("UPDATE conveyor_signal SET changed = ? "
+                          "WHERE ID = 1", (when,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def simulate(press_count=36, ticks=20, stations=6, workdir=None):
+    """
+    :param press_count: (Int): Presses to simulate.
+    :param ticks: (Int): Polls to run, each after one stroke per press.
+    :param stations: (Int): Stations per press.
+    :param workdir: (Str): Directory for the SQLite files. Defaults to a
+    new temporary directory.
+    :return: (dict): Timings (seconds per press per poll) and row counts.
+    Raises AssertionError if a stroke was missed or a journal row not
+    written.
+    """
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='press_sim_')
+    journal_path = os.path.join(workdir, 'journals.sqlite')
+    setup = sqlite3.connect(journal_path)
+    setup.execute("PRAGMA journal_mode=WAL")
+    simulated = []
+    connectors = []
+    for number in range(press_count):
+        name = 'sim{0:03d}'.format(number)
+        signal_path = os.path.join(workdir, name + '_signal.sqlite')
+        connectors.append(SimulatedConnector(signal_path))
+        press = presses.register(name, name + '_good_count_jnl',
+                                 name + '_defect_code_jnl', stations, 23,
+                                 signal_path)
+        create_journals(setup, press)
+        simulated.append(press)
+    setup.close()
+
+    db = ConnectionManager(sqlite3.connect, journal_path, dialect='sqlite',
+                           timeout=30,
+                           detect_types=sqlite3.PARSE_DECLTYPES,
+                           check_same_thread=False)
+    start = time.perf_counter()
+    engine = PressEngine(simulated, db)
+    startup = time.perf_counter() - start
+
+    stroke_polls = 0.0
+    idle_polls = 0.0
+    recorded = 0
+    first = datetime.now()
+    for tick in range(ticks):
+        when = first + timedelta(seconds=26 * tick)
+        for connector in connectors:
+            connector.stroke(when)
+        start = time.perf_counter()
+        recorded += engine.poll()
+        stroke_polls += time.perf_counter() - start
+        start = time.perf_counter()
+        engine.poll()
+        idle_polls += time.perf_counter() - start
+    engine.close()
+    for connector in connectors:
+        connector.close()
+
+    check = sqlite3.connect(journal_path)
+    written = sum(check.execute("SELECT count(*) FROM " + table).fetchone()[0]
+                  for press in simulated
+                  for table in (press.good_table, press.defect_table))
+    check.close()
+    assert recorded == press_count * ticks, \
+        "{0} of {1} strokes recorded.".format(recorded, press_count * ticks)
+    assert written == 2 * press_count * ticks, \
+        "{0} of {1} journal rows written.".format(written,
+                                                  2 * press_count * ticks)
+    return {'presses': press_count,
+            'ticks': ticks,
+            'startup': startup,
+            'stroke_poll_per_press': stroke_polls / ticks / press_count,
+            'idle_poll_per_press': idle_polls / ticks / press_count,
+            'strokes_recorded': recorded,
+            'journal_rows_written': written,
+            'journal_rows_expected': 2 * press_count * ticks}
+
+
+if __name__ == '__main__':
+    for count in (12, 24, 48):
+        report = simulate(count)
+        print('{presses:3d} presses: startup {startup:.2f} s, poll per press '
+              '{stroke_poll_per_press:.6f} s with a stroke, '
+              '{idle_poll_per_press:.6f} s idle; rows '
+              '{journal_rows_written}/{journal_rows_expected}'
+              .format(**report))
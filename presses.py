@@ -0,0 +1,91 @@
+import json
+import os
+from smith_data import Press, DEFAULT_PRESS, STATION_COLUMNS
+
+PRESS_FILE = 'C:/smiths_micrologix_data/presses.json'
+
+# Column names for presses with more stations than the original six.
+NUMBER_WORDS = ('one', 'two', 'three', 'four', 'five', 'six', 'seven',
+                'eight', 'nine', 'ten', 'eleven', 'twelve')
+
+PRESSES = {}  # name: Press
+
+
+def station_columns(stations):
+    """
+    :param stations: (Int): Stations on the press.
+    :return: (tuple): Journal column names, station_one onwards.
+    """
+    assert 1 <= stations <= len(NUMBER_WORDS), \
+        "station count outside of expected range."
+    if stations <= len(STATION_COLUMNS):
+        return STATION_COLUMNS[:stations]
+    return tuple('station_' + word for word in NUMBER_WORDS[:stations])
+
+
+def register(name, good_table, defect_table, stations=6, nameplate=23,
+             signal_path=None, rollup_table=None, history_path=None):
+    """
+    Adds a press to the registry, replacing any entry of the same name.
+    :param name: (Str): Press name, e.g. 'prs457'.
+    :param good_table: (Str): Good count journal table.
+    :param defect_table: (Str): Defect code journal table.
+    :param stations: (Int): Stations on the press.
+    :param nameplate: (Float): Ideal cycle time, seconds.
+    :param signal_path: (Str): The press connector's signal database.
+    :param rollup_table: (Str): Hourly rollup table (see
+    sql/hourly_rollup.sql), or None to keep no rollup.
+    :param history_path: (Str): SQLite file for the press's cycle time
+    history. Defaults to <name>_cycle_history.sqlite beside the signal
+    database; None without one.
+    :return: (Press)
+    """
+    if history_path is None and signal_path is not None:
+        history_path = os.path.join(os.path.dirname(signal_path),
+                                    name + '_cycle_history.sqlite')
+    press = Press(name, good_table, defect_table, station_columns(stations),
+                  nameplate, signal_path, rollup_table, history_path)
+    PRESSES[name] = press
+    return press
+
+
+def load(path=PRESS_FILE):
+    """
+    Registers every press listed in a JSON file: a list of objects with
+    register's arguments as keys.
+    :return: (list): The presses loaded, in file order.
+    """
+    with open(path) as press_file:
+        entries = json.load(press_file)
+    return [register(**entry) for entry in entries]
+
+
+def tracked(path=PRESS_FILE):
+    """
+    The presses this machine tracks: those in the press file, or just the
+    default press if there isn't one.
+    :return: (list): Press entries, in file order.
+    """
+    if os.path.exists(path):
+        return load(path)
+    return [DEFAULT_PRESS]
+
+
+def choose(name=None, path=PRESS_FILE):
+    """
+    The press for a program that shows one, such as the dashboard: the one
+    named (e.g. on its command line), else the first one tracked.
+    :return: (Press): None if no press of that name is known.
+    """
+    presses = tracked(path)
+    if name is None:
+        return presses[0]
+    return PRESSES.get(name)
+
+
+def get(name):
+    assert name in PRESSES, "Press is not registered."
+    return PRESSES[name]
+
+
+PRESSES[DEFAULT_PRESS.name] = DEFAULT_PRESS
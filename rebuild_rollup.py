@@ -0,0 +1,45 @@
+"""
+Rebuilds a press's hourly rollup from its journals, a chunk of hours per
+transaction. The range is given as start and end, e.g.
+
+    python rebuild_rollup.py 2026-09-01 2026-10-01 --press prs457
+
+The press needs its rollup_table set in presses.json (see
+sql/hourly_rollup.sql). Progress is printed per chunk, so an interrupted
+rebuild can be restarted from the last chunk finished.
+"""
+import argparse
+import os
+from datetime import datetime, timedelta
+import pyodbc
+import smith_data as sd
+import presses
+from db_connection import ConnectionManager
+
+
+def parse_time(text):
+    return datetime.strptime(text, '%Y-%m-%d %H:%M' if ' ' in text
+                             else '%Y-%m-%d')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild an hourly rollup.')
+    parser.add_argument('start', type=parse_time,
+                        help="'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM'")
+    parser.add_argument('end', type=parse_time,
+                        help="'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM'")
+    parser.add_argument('--press', default=sd.DEFAULT_PRESS.name)
+    parser.add_argument('--chunk-hours', type=int, default=24)
+    args = parser.parse_args()
+
+    if os.path.exists(presses.PRESS_FILE):
+        presses.load()
+    press = presses.get(args.press)
+    db = ConnectionManager(pyodbc.connect, sd.CONNECTION_STRING)
+    start = args.start
+    while start < args.end:
+        end = min(start + timedelta(hours=args.chunk_hours), args.end)
+        written = sd.rebuild_rollup(db, press, start, end, args.chunk_hours)
+        print('{0} to {1}: {2} rollup rows'.format(start, end, written))
+        start = end
+    db.close()
@@ -0,0 +1,154 @@
+import pickle
+import sqlite3
+import threading
+import numpy as np
+from datetime import datetime
+
+DEFAULT_PATH = 'C:/smiths_micrologix_data/shift_cache.sqlite'
+
+
+class ShiftCache:
+    """
+    Local on-disk copy of the current shift's journal columns, so a restart
+    can show the shift straight away and only read rows past the cached
+    high-water mark from the server. Only rows already confirmed by the
+    server are cached; one entry per journal table, replaced on every save.
+
+    The same file keeps the journal rows a writer still held when it
+    stopped (see JournalWriter's spool), to be queued again on the next
+    start, and the rows the server rejected outright. It also keeps the
+    last conveyor_event each signal database had handled, so strokes
+    logged while nothing was running are caught up.
+    """
+    def __init__(self, path=DEFAULT_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()  # The writer thread uses it too.
+        self.conn.execute("CREATE TABLE IF NOT EXISTS shift_cache ("
+                          "journal TEXT PRIMARY KEY, "
+                          "shift_start TEXT, "
+                          "last_id INTEGER, "
+                          "columns INTEGER, "
+                          "cycles INTEGER, "
+                          "station_values BLOB, "
+                          "submit_times BLOB)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS unsent_rows ("
+                          "statement TEXT, "
+                          "row BLOB)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS signal_events ("
+                          "signal_path TEXT PRIMARY KEY, "
+                          "last_event_id INTEGER)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS quarantined_rows ("
+                          "statement TEXT, "
+                          "row BLOB, "
+                          "error TEXT, "
+                          "quarantined_at TEXT)")
+        self.conn.commit()
+
+    def save(self, table, shift_start, store, last_id, mark):
+        """
+        :param table: (Str): Journal table.
+        :param shift_start: (datetime): Start of the cached shift.
+        :param store: (ColumnStore): The table's columns (any spilled
+        cycles are read back).
+        :param last_id: (Int): Highest journal id read from the server.
+        :param mark: (Int): Cycles in store that came from the server.
+        :return: No return.
+        """
+        values, times = store.cycles(0, mark)
+        values = np.ascontiguousarray(values)
+        times = np.ascontiguousarray(times)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO shift_cache VALUES "
+                              "(?, ?, ?, ?, ?, ?, ?)",
+                              (table, shift_start.isoformat(), last_id,
+                               store.columns, mark, values.tobytes(),
+                               times.view(np.int64).tobytes()))
+            self.conn.commit()
+
+    def load(self, table, shift_start, store):
+        """
+        Appends the cached rows for a table to an empty store, if the cache
+        holds the given shift.
+        :return: (tuple): (last_id, mark), or None if nothing usable was
+        cached.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT last_id, columns, cycles, "
+                                    "station_values, submit_times "
+                                    "FROM shift_cache "
+                                    "WHERE journal = ? AND shift_start = ?",
+                                    (table, shift_start.isoformat())
+                                    ).fetchone()
+        if row is None or row[1] != store.columns:
+            return None
+        last_id, columns, cycles, values, times = row
+        if cycles:
+            store.extend(np.frombuffer(values, dtype=np.uint8)
+                         .reshape(columns, cycles),
+                         np.frombuffer(times, dtype=np.int64)
+                         .view('datetime64[us]'))
+        return last_id, cycles
+
+    def save_event_id(self, signal_path, last_event_id):
+        """
+        :param signal_path: (Str): The connector's signal database.
+        :param last_event_id: (Int): Last conveyor_event ID handled.
+        :return: No return.
+        """
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO signal_events "
+                              "VALUES (?, ?)", (signal_path, last_event_id))
+            self.conn.commit()
+
+    def load_event_id(self, signal_path):
+        """
+        :param signal_path: (Str): The connector's signal database.
+        :return: (Int): Last conveyor_event ID handled, or None if unknown.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT last_event_id FROM "
+                                    "signal_events WHERE signal_path = ?",
+                                    (signal_path,)).fetchone()
+        return row[0] if row else None
+
+    def save_unsent(self, rows):
+        """
+        Replaces the saved unsent rows.
+        :param rows: (list): (statement, row) pairs, in the order written.
+        :return: No return.
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM unsent_rows")
+            self.conn.executemany("INSERT INTO unsent_rows VALUES (?, ?)",
+                                  [(statement, pickle.dumps(tuple(row)))
+                                   for statement, row in rows])
+            self.conn.commit()
+
+    def load_unsent(self):
+        """
+        :return: (list): The saved (statement, row) pairs, oldest first.
+        They stay saved until save_unsent replaces them.
+        """
+        with self.lock:
+            saved = self.conn.execute("SELECT statement, row FROM "
+                                      "unsent_rows ORDER BY rowid").fetchall()
+        return [(statement, pickle.loads(row)) for statement, row in saved]
+
+    def save_quarantined(self, statement, rows, error):
+        """
+        Keeps rows the server rejected, for inspection or a manual resend.
+        :param statement: (Str): INSERT statement that failed.
+        :param rows: (list): Row tuples of the failed batch.
+        :param error: (Str): The server's error.
+        :return: No return.
+        """
+        when = datetime.now().isoformat()
+        with self.lock:
+            self.conn.executemany("INSERT INTO quarantined_rows "
+                                  "VALUES (?, ?, ?, ?)",
+                                  [(statement, pickle.dumps(tuple(row)),
+                                    error, when) for row in rows])
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -1,59 +1,331 @@
 import sqlite3
 import datetime
+import os
+import select
+import struct
+import sys
+import time
+from collections import namedtuple, OrderedDict
+from cycle_stats import CycleStats, HISTORY_PATH
+
+# Constant SQL, so sqlite3's statement cache keeps it prepared between ticks.
+SNAPSHOT_QUERY = "SELECT * FROM conveyor_signal WHERE ID IN (0, 1) ORDER BY ID"
+SIGNAL_QUERY = "SELECT * FROM conveyor_signal WHERE ID = ?"
+EVENT_QUERY = ("SELECT ID, stroke_datetime FROM conveyor_event "
+               "WHERE ID > ? ORDER BY ID")
+SIGNAL_PATH = 'C:/smiths_micrologix_data/signal.sqlite'
+
+# Windows change notifications, for SignalWatcher.
+MAX_WATCHED = 64  # Handles WaitForMultipleObjects can wait on.
+CHANGE_FLAGS = 0x08 | 0x10  # FILE_NOTIFY_CHANGE_SIZE | _LAST_WRITE
+# Linux inotify, likewise.
+IN_MODIFY = 0x02
+IN_NONBLOCK_CLOEXEC = 0o4000 | 0o2000000  # IN_NONBLOCK | IN_CLOEXEC
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length.
+
+
+class SignalSnapshot(namedtuple('SignalSnapshot', ['off', 'on', 'read_at'])):
+    """
+    Both conveyor_signal rows as read together in one statement, plus when
+    they were read. Immutable, so every check made from it agrees.
+    Rows are (ID, seconds in state, time of last change).
+    """
+    __slots__ = ()
+
+    def row(self, signal):
+        return self.on if signal else self.off
+
+    @property
+    def full_cycle(self):
+        return self.off[1] + self.on[1]
+
+    @property
+    def last_change(self):
+        return max(self.off[2], self.on[2])
 
 
 class SignalReader:
-    def __init__(self):
-        self.conn = sqlite3.connect('C:/smiths_micrologix_data/signal.sqlite',
+    def __init__(self, path=SIGNAL_PATH, history=HISTORY_PATH,
+                 last_event_id=None):
+        """
+        :param path: (Str): Connector's signal database.
+        :param history: (Str): SQLite file for the cycle time history, or
+        None to keep none.
+        :param last_event_id: (Int): Last conveyor_event ID already handled,
+        as saved by the previous run, so strokes logged in between are
+        caught up. None to start from the newest.
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path,
                                     detect_types=sqlite3.PARSE_DECLTYPES)
 
-        self.last_on_signal = self.read_signal(1)
-        self.last_off_signal = self.read_signal(0)
+        self.version = self.data_version()  # Changes whenever the connector
+        # commits, so unchanged ticks can skip reading the table.
+        self.latest = self.snapshot()  # Most recent read, shared by the
+        # checks made during a tick.
+        self.has_event_log = self.conn.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'table' "
+                "AND name = 'conveyor_event'").fetchone()[0] > 0  # See
+        # sql/conveyor_event.sql.
+        self.last_event_id = 0  # Strokes up to here are already handled.
+        if self.has_event_log:
+            newest = self.conn.execute(
+                    "SELECT coalesce(max(ID), 0) FROM conveyor_event"
+                    ).fetchone()[0]
+            if last_event_id is None or last_event_id > newest:
+                last_event_id = newest  # Unknown, or the log was recreated.
+            self.last_event_id = last_event_id
+            if last_event_id < newest:
+                self.version = None  # The first check reads the backlog.
+        self.last_on_signal = self.latest.on
+        self.last_off_signal = self.latest.off
         self.signal_dict = {1: self.last_on_signal, 0: self.last_off_signal}
         self.min_cycle_time = 23  # seconds
         self.max_cycle_time = 36  # seconds
         self.current_cycle = 26
+        self.stats = CycleStats(min_cycle=self.min_cycle_time,
+                                max_cycle=self.max_cycle_time,
+                                history=history)  # Measured stroke to
+        # stroke times.
+        self.last_stroke = None
+
+    def snapshot(self):
+        """
+        Reads both signal rows in a single statement.
+        :return: (SignalSnapshot)
+        """
+        off_row, on_row = self.conn.execute(SNAPSHOT_QUERY).fetchall()
+        self.latest = SignalSnapshot(off_row, on_row, datetime.datetime.now())
+        return self.latest
+
+    def data_version(self):
+        # SQLite bumps this when another connection commits to the file.
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def watch_paths(self):
+        """
+        Files that change when the connector writes (the database and, in
+        WAL mode, its write-ahead log), for a file system watcher.
+        :return: (list): Paths that currently exist.
+        """
+        return [path for path in (self.path, self.path + '-wal')
+                if os.path.exists(path)]
 
     def read_signal(self, signal):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM conveyor_signal "
-                       "WHERE ID={}".format(signal))
-        return cursor.fetchone()
+        return self.conn.execute(SIGNAL_QUERY, (signal,)).fetchone()
 
-    def last_signal_change(self):
-        return max(self.read_signal(0)[2], self.read_signal(1)[2])
+    def last_signal_change(self, snapshot=None):
+        return (snapshot or self.snapshot()).last_change
 
-    def cycle_stopped(self):
-        if self.last_signal_change() < \
-                (datetime.datetime.now() -
+    def cycle_stopped(self, snapshot=None):
+        snapshot = snapshot or self.snapshot()
+        if snapshot.last_change < \
+                (snapshot.read_at -
                  datetime.timedelta(seconds=self.max_cycle_time)):
             return True
         else:
             return False
 
-    def cycle_time_ok(self):
-        full_cycle = sum((self.read_signal(0)[1], self.read_signal(1)[1]))
+    def cycle_time_ok(self, snapshot=None):
+        full_cycle = (snapshot or self.snapshot()).full_cycle
         if self.min_cycle_time <= full_cycle <= self.max_cycle_time:
             return True
         else:
             return False
 
-    def signal_changed(self, signal):
-        live_signal = self.read_signal(signal)
-        if self.signal_dict[signal] == live_signal:
-            return False
+    def new_strokes(self):
+        """
+        The once-per-tick check for strokes. With the connector's event log
+        this returns every stroke since the last check, so none are lost if
+        the GUI stalled across several; without it, at most the latest one
+        (from a change in the on signal). Each stroke's time since the one
+        before is recorded in self.stats.
+        :return: (list): Stroke datetimes, oldest first. Empty if none.
+        """
+        version = self.data_version()
+        if version == self.version:
+            return []
+        self.version = version
+        live_signal = self.snapshot().on
+        changed = self.signal_dict[1] != live_signal
+        self.signal_dict[1] = live_signal
+        if self.has_event_log:
+            events = self.conn.execute(EVENT_QUERY,
+                                       (self.last_event_id,)).fetchall()
+            if events:
+                self.last_event_id = events[-1][0]
+            strokes = [stroke for ignore, stroke in events]
+        elif changed:
+            strokes = [live_signal[2]]
         else:
-            self.signal_dict[signal] = live_signal
-            return True
+            strokes = []
+        for stroke in strokes:
+            if self.last_stroke is not None:
+                self.stats.add((stroke - self.last_stroke).total_seconds(),
+                               stroke)
+            self.last_stroke = stroke
+        return strokes
 
-    def update_cycle(self):
-        if self.cycle_time_ok() and not self.cycle_stopped():
-            self.current_cycle = sum((self.read_signal(0)[1],
-                                      self.read_signal(1)[1]))
+    def update_cycle(self, snapshot=None):
+        # Uses the tick's snapshot rather than reading again.
+        snapshot = snapshot or self.latest
+        if self.cycle_time_ok(snapshot) and not self.cycle_stopped(snapshot):
+            self.current_cycle = snapshot.full_cycle
             return self.current_cycle
         else:
             return self.current_cycle
 
-signal = SignalReader()
-new_signal = SignalReader()
+    def close(self):
+        self.stats.close()
+        self.conn.close()
+
+
+class SignalWatcher:
+    """
+    Waits for connectors to write their signal databases, so a stroke is
+    picked up as soon as it lands instead of at the end of the poll
+    interval. Each directory holding a watched database gets a change
+    notification handle on Windows, or an inotify watch on Linux, and
+    wait() blocks on them all at once. Elsewhere, or past MAX_WATCHED
+    directories on Windows, there is nothing to wait on and those readers
+    are simply reported every time. Notifications can be late or spurious
+    (other files share a directory), so callers should still poll every
+    press each interval, and rely on the readers' data_version check to
+    skip presses that didn't change.
+    """
+    def __init__(self, readers):
+        """
+        :param readers: (dict): key: SignalReader. wait() reports keys.
+        """
+        self.kernel32 = None
+        self.handles = []  # Change notification handle per directory.
+        self.keys = []  # Keys of the readers in each handle's directory.
+        self.inotify = None  # inotify file descriptor, on Linux.
+        self.watches = {}  # Keys of the readers per inotify watch.
+        self.unwatched = []  # Keys of readers with no handle.
+        directories = OrderedDict()  # directory: keys
+        for key, reader in readers.items():
+            paths = reader.watch_paths()
+            if not paths:
+                self.unwatched.append(key)
+                continue
+            directory = os.path.dirname(os.path.abspath(paths[0]))
+            directories.setdefault(directory, []).append(key)
+        if sys.platform == 'win32':
+            self._open_handles(directories)
+        elif sys.platform.startswith('linux'):
+            self._open_inotify(directories)
+        else:
+            for keys in directories.values():
+                self.unwatched.extend(keys)
+
+    def _open_handles(self, directories):
+        import ctypes
+        from ctypes import wintypes
+        kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        kernel32.FindFirstChangeNotificationW.restype = wintypes.HANDLE
+        kernel32.FindFirstChangeNotificationW.argtypes = (
+                wintypes.LPCWSTR, wintypes.BOOL, wintypes.DWORD)
+        kernel32.FindNextChangeNotification.argtypes = (wintypes.HANDLE,)
+        kernel32.FindCloseChangeNotification.argtypes = (wintypes.HANDLE,)
+        kernel32.WaitForSingleObject.argtypes = (wintypes.HANDLE,
+                                                 wintypes.DWORD)
+        kernel32.WaitForSingleObject.restype = wintypes.DWORD
+        kernel32.WaitForMultipleObjects.argtypes = (
+                wintypes.DWORD, ctypes.POINTER(wintypes.HANDLE),
+                wintypes.BOOL, wintypes.DWORD)
+        kernel32.WaitForMultipleObjects.restype = wintypes.DWORD
+        invalid = wintypes.HANDLE(-1).value
+        for directory, keys in directories.items():
+            handle = None
+            if len(self.handles) < MAX_WATCHED:
+                handle = kernel32.FindFirstChangeNotificationW(
+                        directory, False, CHANGE_FLAGS)
+            if handle in (None, invalid):
+                self.unwatched.extend(keys)  # Polled instead.
+                continue
+            self.handles.append(handle)
+            self.keys.append(keys)
+        self.kernel32 = kernel32
+        self._array = (wintypes.HANDLE * len(self.handles))(*self.handles)
+
+    def _open_inotify(self, directories):
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK_CLOEXEC)
+        if fd < 0:
+            for keys in directories.values():
+                self.unwatched.extend(keys)
+            return
+        for directory, keys in directories.items():
+            watch = libc.inotify_add_watch(fd, os.fsencode(directory),
+                                           IN_MODIFY)
+            if watch < 0:
+                self.unwatched.extend(keys)  # Polled instead.
+                continue
+            self.watches.setdefault(watch, []).extend(keys)
+        self.inotify = fd
+
+    @property
+    def watching(self):
+        # True if any reader is woken by change notifications.
+        return bool(self.handles or self.watches)
+
+    def _wait_inotify(self, timeout):
+        changed = list(self.unwatched)
+        if not select.select([self.inotify], [], [], timeout)[0]:
+            return changed
+        try:
+            while True:
+                events = os.read(self.inotify, 65536)
+                offset = 0
+                while offset < len(events):
+                    watch, mask, cookie, length = \
+                        INOTIFY_EVENT.unpack_from(events, offset)
+                    offset += INOTIFY_EVENT.size + length
+                    for key in self.watches.get(watch, ()):
+                        if key not in changed:
+                            changed.append(key)
+        except BlockingIOError:
+            pass  # Drained.
+        return changed
+
+    def wait(self, timeout):
+        """
+        Blocks until a watched directory changes or the timeout passes.
+        :param timeout: (Float): Seconds.
+        :return: (list): Keys of the readers that may have new strokes:
+        those in any directory that changed, plus every unwatched one.
+        """
+        if self.watches:
+            return self._wait_inotify(timeout)
+        if not self.handles:
+            time.sleep(timeout)
+            return list(self.unwatched)
+        kernel32 = self.kernel32
+        fired = kernel32.WaitForMultipleObjects(len(self.handles),
+                                                self._array, False,
+                                                int(timeout * 1000))
+        changed = list(self.unwatched)
+        if fired >= len(self.handles):
+            return changed  # Timed out (or the wait failed).
+        for index, handle in enumerate(self.handles):
+            # The one that fired, and any others already signalled.
+            if index == fired or kernel32.WaitForSingleObject(handle, 0) == 0:
+                kernel32.FindNextChangeNotification(handle)
+                changed.extend(self.keys[index])
+        return changed
+
+    def close(self):
+        for handle in self.handles:
+            self.kernel32.FindCloseChangeNotification(handle)
+        self.handles = []
+        if self.inotify is not None:
+            os.close(self.inotify)  # Removes its watches too.
+            self.inotify = None
+            self.watches = {}
+
 
+if __name__ == '__main__':
+    signal = SignalReader()
+    print(signal.snapshot(), signal.update_cycle())
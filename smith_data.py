@@ -1,26 +1,676 @@
-import pyodbc
 from datetime import datetime, timedelta
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import pandas as pd
 import math
+import tempfile
+from journal_buffer import JournalBuffer, JournalWriter
+from db_connection import ConnectionManager
+from signal_reader import SIGNAL_PATH
+from cycle_stats import HISTORY_PATH
 
+CONNECTION_STRING = ('DRIVER={SQL Server};'
+                     'SERVER=ZIRSYSPRO;'
+                     'DATABASE=MAINTDATA;'
+                     'Trusted_Connection=yes')
 
-class DataManager:
-    def __init__(self):
+GOOD_TABLE = 'prs457_good_count_jnl'
+DEFECT_TABLE = 'prs457_defect_code_jnl'
+ID_COLUMN = 'id'  # Identity column, used as the reload high-water mark.
+STATION_COLUMNS = ('station_one', 'station_two', 'station_three',
+                   'station_four', 'station_five', 'station_six')
+# Columns the dashboard reads and writes, submit_datetime always last.
+JOURNAL_COLUMNS = {
+    GOOD_TABLE: STATION_COLUMNS + ('total_good', 'submit_datetime'),
+    DEFECT_TABLE: STATION_COLUMNS + ('submit_datetime',),
+}
+FETCH_SIZE = 500  # Rows per fetchmany when streaming a shift.
+HOT_CYCLES = 2048  # Cycles per journal kept in memory; older ones spill.
+PREFIX_POINTS = 1024  # Most points kept of the spilled expanding average.
+LTTB_TABLE_WIDTH = 32  # Widest lttb bucket picked by table; see lttb.
 
-        self.now = datetime.now()
-        self.conn = self.conn = pyodbc.connect('DRIVER={SQL Server};'
-                                               'SERVER=ZIRSYSPRO;'
-                                               'DATABASE=MAINTDATA;'
-                                               'Trusted_Connection=yes')
-        self.prod_lists = self.sql_data_lists('prs457_good_count_jnl',
-                                              *self.current_shift())
+# Report bucket start for a time column ({0}), by server dialect. Shifts
+# start at 7:00, 15:00 and 23:00, and a production day at 7:00.
+REPORT_BUCKETS = {
+    'mssql': {
+        'hour': "DATEADD(hour, DATEDIFF(hour, 0, {0}), 0)",
+        'shift': "DATEADD(hour, (DATEDIFF(hour, 0, {0}) - 7) / 8 * 8 + 7, 0)",
+        'day': "DATEADD(hour, DATEDIFF(day, 0, DATEADD(hour, -7, {0})) * 24 "
+               "+ 7, 0)",
+    },
+    'sqlite': {
+        'hour': "strftime('%Y-%m-%d %H:00:00', {0})",
+        'shift': "datetime(strftime('%Y-%m-%d', {0}, '-7 hours'), '+' || "
+                 "(CAST(strftime('%H', {0}, '-7 hours') AS INTEGER) / 8 * 8 "
+                 "+ 7) || ' hours')",
+        'day': "datetime(strftime('%Y-%m-%d', {0}, '-7 hours'), '+7 hours')",
+    },
+}
+BUCKET_HOURS = {'hour': 1, 'shift': 8, 'day': 24}
+
+ROLLUP_TABLE = 'prs457_hourly_rollup'  # See sql/hourly_rollup.sql. Off
+# until the press's entry in presses.json names it, once the table exists.
+# Adds pieces to one (hour_start, station, defect_code) rollup row,
+# creating it if needed. Parameters: hour_start, station, defect_code,
+# pieces.
+ROLLUP_UPSERT = {
+    'mssql': "MERGE {0} WITH (HOLDLOCK) AS r "
+             "USING (SELECT ? AS hour_start, ? AS station, ? AS defect_code, "
+             "? AS pieces) AS c "
+             "ON r.hour_start = c.hour_start AND r.station = c.station AND "
+             "r.defect_code = c.defect_code "
+             "WHEN MATCHED THEN UPDATE SET pieces = r.pieces + c.pieces "
+             "WHEN NOT MATCHED THEN INSERT (hour_start, station, "
+             "defect_code, pieces) VALUES (c.hour_start, c.station, "
+             "c.defect_code, c.pieces);",
+    'sqlite': "INSERT INTO {0} (hour_start, station, defect_code, pieces) "
+              "VALUES (?, ?, ?, ?) "
+              "ON CONFLICT (hour_start, station, defect_code) "
+              "DO UPDATE SET pieces = pieces + excluded.pieces",
+}
+
+
+class Press(namedtuple('Press', ['name', 'good_table', 'defect_table',
+                                 'station_columns', 'nameplate',
+                                 'signal_path', 'rollup_table',
+                                 'history_path'])):
+    """
+    What the data manager needs to know about one press: its two journal
+    tables, the station columns both tables share, the nameplate cycle time
+    (seconds), the connector's signal database and, optionally, its hourly
+    rollup table and the local file for its cycle time history. See
+    presses.py for the registry.
+    """
+    __slots__ = ()
+
+    def __new__(cls, name, good_table, defect_table, station_columns,
+                nameplate, signal_path, rollup_table=None, history_path=None):
+        return super(Press, cls).__new__(cls, name, good_table, defect_table,
+                                         station_columns, nameplate,
+                                         signal_path, rollup_table,
+                                         history_path)
+
+    @property
+    def stations(self):
+        return len(self.station_columns)
+
+    def columns(self, table):
+        # Columns the dashboard reads and writes, submit_datetime last.
+        if table == self.good_table:
+            return self.station_columns + ('total_good', 'submit_datetime')
+        return self.station_columns + ('submit_datetime',)
+
+
+DEFAULT_PRESS = Press('prs457', GOOD_TABLE, DEFECT_TABLE, STATION_COLUMNS,
+                      23, SIGNAL_PATH, None, HISTORY_PATH)
+
+
+def insert_statement(table, columns=None):
+    if columns is None:
+        columns = JOURNAL_COLUMNS[table]
+    return "INSERT INTO {0}({1}) VALUES ({2})".format(
+        table, ', '.join(columns), ', '.join('?' * len(columns)))
+
+
+def range_statement(table, delta=False, columns=None):
+    # Bounds are bound as parameters so the server can reuse one plan; see
+    # sql/journal_indexes.sql for the supporting index. The delta form only
+    # returns rows past an id high-water mark.
+    if columns is None:
+        columns = JOURNAL_COLUMNS[table]
+    return ("SELECT {0}, {1} FROM {2} WHERE {3}"
+            "submit_datetime > ? AND submit_datetime < ? ORDER BY {0}"
+            .format(ID_COLUMN, ', '.join(columns), table,
+                    ID_COLUMN + ' > ? AND ' if delta else ''))
+
+
+def report_statement(table, select, bucket=None, where='', group='',
+                     column='submit_datetime'):
+    """
+    A GROUP BY report over a half-open time range, parameters (start, end).
+    For the journals the range seek is covered by sql/journal_indexes.sql.
+    :param table: (Str): Journal (or rollup) table.
+    :param select: (Str): Columns and aggregates.
+    :param bucket: (Str): Bucket expression (from REPORT_BUCKETS, for the
+    same column), selected first as bucket; None for no time buckets.
+    :param where: (Str): Extra condition.
+    :param group: (Str): GROUP BY columns besides the bucket.
+    :param column: (Str): Time column the range applies to.
+    :return: (Str): Statement.
+    """
+    groups = [expression for expression in (bucket, group) if expression]
+    if bucket is not None:
+        select = bucket + ' AS bucket, ' + select
+    statement = ("SELECT {0} FROM {1} WHERE {2} >= ? AND {2} < ?"
+                 .format(select, table, column))
+    if where:
+        statement += ' AND ' + where
+    if groups:
+        statement += ' GROUP BY ' + ', '.join(groups)
+    return statement
+
+
+def hour_of(when):
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def rebuild_rollup(db, press, start_time, end_time, chunk_hours=24):
+    """
+    Recomputes a press's hourly rollup from its defect journal, one chunk of
+    hours per transaction, so a long range never holds locks for long and
+    an interrupted rebuild can be resumed from the last chunk reported.
+    Each chunk's rollup rows are deleted and re-inserted from a server-side
+    GROUP BY. Rows committed to the journal mid-chunk are caught by the
+    chunk or by the normal write path, but rebuilding the current hour
+    while cycles are being recorded can double count them; rebuild closed
+    hours.
+    :param db: (ConnectionManager): Server connections.
+    :param press: (Press): Press whose rollup to rebuild.
+    :param start_time: (datetime): Range start, taken back to the hour.
+    :param end_time: (datetime): Range end, taken on to the next hour.
+    :param chunk_hours: (Int): Hours per transaction.
+    :return: (Int): Rollup rows written.
+    """
+    assert press.rollup_table, "Press has no rollup table."
+    start_time = hour_of(start_time)
+    if hour_of(end_time) != end_time:
+        end_time = hour_of(end_time) + timedelta(hours=1)
+    bucket = REPORT_BUCKETS[db.dialect]['hour'].format('submit_datetime')
+    delete = ("DELETE FROM {0} WHERE hour_start >= ? AND hour_start < ?"
+              .format(press.rollup_table))
+    insert = ("INSERT INTO {0} (hour_start, station, defect_code, pieces) "
+              .format(press.rollup_table) +
+              ' UNION ALL '.join(
+                  report_statement(press.defect_table,
+                                   '{0}, {1}, COUNT(*)'.format(station,
+                                                                column),
+                                   bucket, group=column)
+                  for station, column in enumerate(press.station_columns,
+                                                   1)))
+    conn = db.connection()
+    cursor = conn.cursor()
+    written = 0
+    while start_time < end_time:
+        chunk_end = min(start_time + timedelta(hours=chunk_hours), end_time)
+        try:
+            cursor.execute(delete, (start_time, chunk_end))
+            cursor.execute(insert, (start_time, chunk_end) * press.stations)
+            written += max(cursor.rowcount, 0)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        start_time = chunk_end
+    cursor.close()
+    return written
+
+
+def lttb(values, threshold, x=None):
+    """
+    Largest-triangle-three-buckets downsampling. Keeps the first and last
+    points and, from each bucket in between, the point making the largest
+    triangle with its neighbours, so peaks and dips survive. Kept values
+    are taken from the series unchanged.
+
+    Which point a bucket keeps depends only on which point the bucket before
+    it kept, so for narrow buckets (the usual case: a shift of a few
+    thousand points onto a chart) every bucket's choice is worked out for
+    each point the previous bucket could keep, all in one array operation,
+    and the kept points are then just looked up from the first bucket on.
+    Wide buckets would make that table too big and are done one at a time.
+    :param values: (array): Series values.
+    :param threshold: (Int): Most points to keep.
+    :param x: (array): Increasing x of each value, for a series that isn't
+    evenly spaced; defaults to the index.
+    :return: (tuple): (indices kept, values at those indices).
+    """
+    values = np.asarray(values)
+    count = len(values)
+    if threshold >= count or threshold < 3:
+        return np.arange(count), values
+    if x is None:
+        x = np.arange(count)
+    x = np.asarray(x, dtype=np.float64)
+    y = values.astype(np.float64)
+    buckets = threshold - 2
+    every = (count - 2) / buckets
+    edges = np.floor(np.arange(threshold - 1) * every).astype(np.int64) + 1
+    edges[-1] = count - 1
+    # Mean of the bucket after each one (the last point after the last).
+    next_start = np.append(edges[1:-1], count - 1)
+    next_end = np.append(edges[2:], count)
+    sum_x = np.concatenate([[0.0], np.cumsum(x)])
+    sum_y = np.concatenate([[0.0], np.cumsum(y)])
+    next_x = (sum_x[next_end] - sum_x[next_start]) / (next_end - next_start)
+    next_y = (sum_y[next_end] - sum_y[next_start]) / (next_end - next_start)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = count - 1
+
+    width = int(np.diff(edges).max())
+    if width > LTTB_TABLE_WIDTH:
+        chosen = 0
+        for bucket in range(buckets):
+            start, end = edges[bucket], edges[bucket + 1]
+            area = np.abs((x[chosen] - next_x[bucket]) *
+                          (y[start:end] - y[chosen]) -
+                          (x[chosen] - x[start:end]) *
+                          (next_y[bucket] - y[chosen]))
+            chosen = start + int(area.argmax())
+            keep[bucket + 1] = chosen
+        return keep, values[keep]
+
+    # Buckets x width indices, padded past each bucket's end, and for each
+    # bucket the points the previous one could keep (just the first point
+    # for the first bucket).
+    index = edges[:-1, np.newaxis] + np.arange(width)
+    padding = index >= edges[1:, np.newaxis]
+    index = np.minimum(index, count - 1)
+    base = np.concatenate([np.zeros((1, width), dtype=np.int64), index[:-1]])
+    base_x = x[base][:, :, np.newaxis]
+    base_y = y[base][:, :, np.newaxis]
+    # area[bucket, previous pick, candidate].
+    area = np.abs((base_x - next_x[:, np.newaxis, np.newaxis]) *
+                  (y[index][:, np.newaxis, :] - base_y) -
+                  (base_x - x[index][:, np.newaxis, :]) *
+                  (next_y[:, np.newaxis, np.newaxis] - base_y))
+    area[np.broadcast_to(padding[:, np.newaxis, :], area.shape)] = -1
+    best = area.argmax(axis=2).tolist()
+    pick = 0
+    for bucket, picks in enumerate(best):
+        pick = picks[pick]
+        keep[bucket + 1] = index[bucket, pick]
+    return keep, values[keep]
+
+
+class ColumnStore:
+    """
+    Growable columnar store for one journal table. Station values are rows of
+    a single contiguous 2-D array and submit_datetime is kept in its own
+    datetime64 array. Capacity doubles when full, so appends are amortized
+    O(1).
+
+    The oldest cycles can be moved out of memory with spill(), into a
+    temporary file of fixed-size records; start is the number of cycles
+    held there, ahead of the ones in memory. Indices taken or given by
+    len(), truncate(), since() and cycles() count from the first cycle,
+    spilled or not; values and times only cover the cycles in memory.
+    """
+    def __init__(self, columns, dtype=np.uint8, timestamps=True,
+                 capacity=2048):
+        self.columns = columns
+        self.start = 0
+        self.size = 0  # Cycles in memory.
+        self._values = np.zeros((columns, capacity), dtype=dtype)
+        if timestamps:
+            self._times = np.zeros(capacity, dtype='datetime64[us]')
+        else:
+            self._times = None
+        self._record = np.dtype([('values', dtype, (columns,)),
+                                 ('time', np.int64)])
+        self._spill = None  # Temporary file, made on the first spill.
+
+    def __len__(self):
+        return self.start + self.size
+
+    @property
+    def capacity(self):
+        return self._values.shape[1]
+
+    @classmethod
+    def from_lists(cls, list_of_lists, dtype=np.uint8):
+        """
+        Builds a store from column lists, station columns first and the
+        submit_datetime column last (the old prod_lists/defect_lists layout).
+        :param list_of_lists: (list): Column lists, all the same length.
+        :return: ColumnStore
+        """
+        store = cls(len(list_of_lists) - 1, dtype=dtype)
+        store.extend(np.array(list_of_lists[:-1], dtype=dtype)
+                     .reshape(store.columns, -1),
+                     list_of_lists[-1])
+        return store
+
+    def _reserve(self, size):
+        capacity = self.capacity
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        values = np.zeros((self.columns, capacity), dtype=self._values.dtype)
+        values[:, :self.size] = self._values[:, :self.size]
+        self._values = values
+        if self._times is not None:
+            times = np.zeros(capacity, dtype=self._times.dtype)
+            times[:self.size] = self._times[:self.size]
+            self._times = times
+
+    def append(self, values, timestamp=None):
+        self._reserve(self.size + 1)
+        self._values[:, self.size] = values
+        if self._times is not None:
+            self._times[self.size] = np.datetime64(timestamp, 'us')
+        self.size += 1
+
+    def extend(self, values, timestamps=None):
+        """
+        Appends a block of cycles.
+        :param values: (2-D array): columns x cycles.
+        :param timestamps: (sequence): One submit_datetime per cycle.
+        :return: No return.
+        """
+        count = np.shape(values)[1]
+        self._reserve(self.size + count)
+        self._values[:, self.size:self.size + count] = values
+        if self._times is not None:
+            self._times[self.size:self.size + count] = \
+                np.array(timestamps, dtype='datetime64[us]')
+        self.size += count
+
+    def truncate(self, size):
+        """
+        Drops every cycle from index size on. Spilled cycles must be brought
+        back with unspill first, unless nothing was ever written to disk
+        (see drop).
+        :param size: (Int): Cycles to keep.
+        :return: No return.
+        """
+        assert 0 <= size <= len(self), "cannot truncate past the end."
+        if size < self.start:
+            assert self._spill is None, "unspill before truncating."
+            self.start, self.size = size, 0
+            return
+        self.size = size - self.start
+
+    def drop(self, count):
+        # Forgets the oldest count cycles in memory; start moves past them.
+        assert 0 <= count <= self.size, "cannot drop more than is held."
+        keep = self.size - count
+        self._values[:, :keep] = self._values[:, count:self.size]
+        if self._times is not None:
+            self._times[:keep] = self._times[count:self.size]
+        self.start += count
+        self.size = keep
+
+    def spill(self, count, directory=None):
+        """
+        Moves the oldest count cycles in memory to the spill file.
+        :param count: (Int): Cycles to move.
+        :param directory: (Str): Where the spill file goes, if it doesn't
+        exist yet. Defaults to the system temporary directory.
+        :return: No return.
+        """
+        assert 0 <= count <= self.size, "cannot spill more than is held."
+        if not count:
+            return
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(prefix='press_spill_',
+                                                 dir=directory)
+        records = np.zeros(count, dtype=self._record)
+        records['values'] = self._values[:, :count].transpose()
+        if self._times is not None:
+            records['time'] = self._times[:count].view(np.int64)
+        self._spill.seek(self.start * self._record.itemsize)
+        self._spill.write(records.tobytes())
+        self.drop(count)
+
+    def _read_spill(self, begin, end):
+        # Spilled cycles begin to end, as (values, times).
+        self._spill.seek(begin * self._record.itemsize)
+        records = np.frombuffer(
+                self._spill.read((end - begin) * self._record.itemsize),
+                dtype=self._record)
+        return (records['values'].transpose(),
+                records['time'].view('datetime64[us]'))
+
+    def unspill(self, index):
+        """
+        Brings the spilled cycles from index on back into memory, e.g. to
+        roll the store back past them.
+        :param index: (Int): First cycle to bring back.
+        :return: No return.
+        """
+        if index >= self.start:
+            return
+        values, times = self._read_spill(index, self.start)
+        count = self.start - index
+        self._reserve(self.size + count)
+        self._values[:, count:count + self.size] = \
+            self._values[:, :self.size].copy()
+        self._values[:, :count] = values
+        if self._times is not None:
+            self._times[count:count + self.size] = \
+                self._times[:self.size].copy()
+            self._times[:count] = times
+        self._spill.truncate(index * self._record.itemsize)
+        self.start = index
+        self.size += count
+
+    def close(self):
+        # Removes the spill file (held cycles are kept).
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def since(self, index):
+        # Read-only values of the cycles in memory from index on.
+        assert index >= self.start, "cycles before index were spilled."
+        return self.values[:, index - self.start:]
+
+    def cycles(self, begin=0, end=None):
+        """
+        Values and times of any run of cycles, spilled or not. Spilled ones
+        are read back from disk, so this is for occasional full-shift reads
+        (caching, a new subscriber), not the per-cycle path.
+        :param begin: (Int): First cycle.
+        :param end: (Int): Cycle to stop before. Defaults to the last.
+        :return: (tuple): (columns x cycles values, times).
+        """
+        if end is None:
+            end = len(self)
+        assert 0 <= begin <= end <= len(self), "cycles out of range."
+        held = (self._values[:, max(begin - self.start, 0):
+                             max(end - self.start, 0)],
+                self._times[max(begin - self.start, 0):
+                            max(end - self.start, 0)]
+                if self._times is not None else None)
+        if begin >= self.start:
+            return held
+        values, times = self._read_spill(begin, min(end, self.start))
+        if self._times is None:
+            times = None
+        else:
+            times = np.concatenate([times, held[1]])
+        return np.concatenate([values, held[0]], axis=1), times
+
+    @property
+    def values(self):
+        view = self._values[:, :self.size]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def times(self):
+        view = self._times[:self.size]
+        view.flags.writeable = False
+        return view
+
+    def column_lists(self):
+        # The whole store in the old list of lists order: one array per
+        # column, then submit_datetime. Read-only views unless cycles were
+        # spilled, which are read back.
+        if self.start:
+            values, times = self.cycles()
+        else:
+            values = self.values
+            times = self.times if self._times is not None else None
+        columns = list(values)
+        if times is not None:
+            columns.append(times)
+        return columns
+
+
+class ChangeTracker:
+    """
+    Remembers what each station's charts last showed, so a display pass only
+    redraws the stations whose defect ranking or production series changed.
+    A ranking counts as changed when its codes or counts differ. A series
+    grows by a point every cycle, so it counts as changed when the station
+    had a defect, its mean moved more than series_tolerance, or it hasn't
+    been redrawn for max_stale cycles.
+    """
+    def __init__(self, series_tolerance=.005, max_stale=10):
+        self.series_tolerance = series_tolerance
+        self.max_stale = max_stale
+        self.rankings = {}  # station: top three last shown.
+        self.means = {}  # station: expanding mean last shown.
+        self.shown_at = {}  # station: cycle count when last shown.
+        self.defects = set()  # Stations with a defect since last shown.
+        self.reloaded = True  # Bulk change; show everything next time.
+
+    def defect(self, station):
+        self.defects.add(station)
+
+    def reload(self):
+        self.reloaded = True
+
+    def take(self, data):
+        """
+        Works out what changed since the last call and records the new state
+        as shown.
+        :param data: (DataManager): Source of the current values.
+        :return: (tuple): (stations with a changed ranking, stations with a
+        changed series), each a sorted list.
+        """
+        cycles = data.press_cycles()
+        rankings = []
+        series = []
+        top = data.top_defects() if self.reloaded or self.defects else {}
+        for station in range(1, data.stations + 1):
+            if self.reloaded or station in self.defects:
+                ranking = top[station]
+                if ranking != self.rankings.get(station):
+                    self.rankings[station] = ranking
+                    rankings.append(station)
+            mean = data.station_mean(station)
+            if (self.reloaded or station in self.defects or
+                    abs(mean - self.means.get(station, 0)) >
+                    self.series_tolerance or
+                    cycles - self.shown_at.get(station, 0) >= self.max_stale):
+                self.means[station] = mean
+                self.shown_at[station] = cycles
+                series.append(station)
+        self.defects.clear()
+        self.reloaded = False
+        return rankings, series
+
+
+class DashboardSnapshot(namedtuple('DashboardSnapshot', [
+        'shift', 'cycles', 'press_good', 'station_good', 'percent',
+        'top_defects', 'summary', 'cycle_time', 'rolling_rate',
+        'changed_rankings', 'series'])):
+    """
+    Every number the dashboard shows for one cycle, from
+    DataManager.snapshot. It is a tuple: nothing in it can change after it
+    is built (its arrays are read-only), so it can be passed to other
+    threads, or pickled to other processes, without copying or locking.
+    Per station fields are tuples indexed by station - 1.
+    shift: (tuple): Shift start and end datetimes.
+    cycles: (Int): Press cycles this shift.
+    press_good: (Int): Good pieces, all stations.
+    station_good: (tuple): Good pieces per station.
+    percent: (tuple): Share of good pieces per station.
+    top_defects: (tuple): (codes, counts) per station, as rank_codes.
+    summary: (tuple): As production_summary.
+    cycle_time: (Float): Last cycle time, seconds.
+    rolling_rate: (Float): Rolling cycle time used for the summary.
+    changed_rankings: (tuple): Stations whose defect ranking changed since
+    the last snapshot.
+    series: (tuple): (station, cycle indices, expanding average) for each
+    station whose series changed since the last snapshot.
+    """
+    __slots__ = ()
+
+    @property
+    def stations(self):
+        return len(self.station_good)
 
-        self.defect_lists = self.sql_data_lists('prs457_defect_code_jnl',
-                                                *self.current_shift())
+    @property
+    def changed_series(self):
+        return tuple(station for station, cycles, average in self.series)
+
+
+class DataManager:
+    def __init__(self, db=None, cache=None, press=DEFAULT_PRESS, writer=None,
+                 pool=None, offline=False, hot_cycles=HOT_CYCLES,
+                 spill_dir=None):
+        """
+        :param db: (ConnectionManager): Server connections. Defaults to the
+        production server.
+        :param cache: (ShiftCache): Optional local cache for warm starts.
+        :param press: (Press): Press to track.
+        :param writer: (JournalWriter): A journal writer shared with other
+        presses. By default the manager starts its own; a shared one (and
+        db and cache) is left for its owner to stop and close.
+        :param pool: (Executor): Pool for background server reads. By
+        default a thread is started when one is needed.
+        :param offline: (Bool): Never touch the server or start the writer.
+        The shift is fed in with load_shift and record_cycles instead, as
+        in a dashboard subscribed to the collector.
+        :param hot_cycles: (Int): Cycles per journal kept in memory. Older
+        cycles are spilled to a temporary file (see retain), so memory stays
+        flat however long the shift; totals still cover the whole shift.
+        :param spill_dir: (Str): Directory for the spill files. Defaults to
+        the system temporary directory.
+        """
+        self.now = datetime.now()
+        self.offline = offline
+        if db is None and not offline:
+            import pyodbc  # Only needed here; offline copies skip it.
+            db = ConnectionManager(pyodbc.connect, CONNECTION_STRING)
+        self.db = db  # Shared with Main (and the writer thread).
+        self.press = press
+        self.stations = press.stations
+        self.good_table = press.good_table
+        self.defect_table = press.defect_table
+        self.good_insert = insert_statement(
+                self.good_table, press.columns(self.good_table))
+        self.defect_insert = insert_statement(
+                self.defect_table, press.columns(self.defect_table))
+        self.rollup_upsert = None  # Keeps the hourly rollup in step.
+        if press.rollup_table and not offline:
+            self.rollup_upsert = ROLLUP_UPSERT[self.db.dialect].format(
+                    press.rollup_table)
+        # Journal rows are written behind the in-memory lists, by a worker
+        # thread with its own connection.
+        self._shared = writer is not None
+        if writer is None:
+            writer = JournalWriter(JournalBuffer(self.db), spool=cache)
+        self.writer = writer
+        self.journal = writer.buffer
+        if self.rollup_upsert is not None:
+            # A batch's pieces for the same hour, station and code go out
+            # as one upsert.
+            self.journal.additive.add(self.rollup_upsert)
+        self.pool = pool
+        self._cycle_rows = []  # Rows of the cycle being recorded.
+        self._backlog = deque()  # Cycles the writer queue had no room for.
+        self.cache = cache  # Optional local ShiftCache for warm starts.
+        self._reconcile = None  # Background server read; see _read_behind.
+        self.changes = ChangeTracker()  # What the display needs to redraw.
+        self.hot_cycles = hot_cycles
+        self.spill_dir = spill_dir
+        self.prod_lists = []
+        self.defect_lists = []
+        if offline:
+            self.shift = self.current_shift()
+            self._marks = {self.good_table: (None, 0),
+                           self.defect_table: (None, 0)}
+        elif not self.warm_start():
+            self.data_reset()
 
         # Production constants.
-        self.nameplate = 23 # seconds per cycle, ideal/nominal.
+        self.nameplate = press.nameplate # seconds per cycle, ideal/nominal.
         self.break_time = 1 # hour per shift
         self.hours_per_shift = 8
 
@@ -28,44 +678,365 @@ class DataManager:
         self.now = datetime.now()
         hour = self.now.hour
         assert 0 <= hour <= 23, "hour out of range for current_shift method."
+        # microsecond=0 so the same shift always compares equal.
         if 7 <= hour <= 14:
-            start_time = self.now.replace(hour=7, minute=0, second=0)
-            end_time = self.now.replace(hour=14, minute=59, second=59)
+            start_time = self.now.replace(hour=7, minute=0, second=0,
+                                          microsecond=0)
+            end_time = self.now.replace(hour=14, minute=59, second=59,
+                                        microsecond=0)
         elif 15 <= hour <= 22:
-            start_time = self.now.replace(hour=15, minute=0, second=0)
-            end_time = self.now.replace(hour=22, minute=59, second=59)
+            start_time = self.now.replace(hour=15, minute=0, second=0,
+                                          microsecond=0)
+            end_time = self.now.replace(hour=22, minute=59, second=59,
+                                        microsecond=0)
         elif hour == 23:
             tomorrow = self.now + timedelta(days=1)
-            start_time = self.now.replace(hour=23, minute=0, second=0)
-            end_time = tomorrow.replace(hour=6, minute=59, second=59)
+            start_time = self.now.replace(hour=23, minute=0, second=0,
+                                          microsecond=0)
+            end_time = tomorrow.replace(hour=6, minute=59, second=59,
+                                        microsecond=0)
         elif 0 <= hour <= 6:
-            yesterday = self.now - timedelta(days=-1)
-            start_time = yesterday.replace(hour=23, minute=0, second=0)
-            end_time = self.now.replace(hour=6, minute=59, second=59)
+            yesterday = self.now - timedelta(days=1)
+            start_time = yesterday.replace(hour=23, minute=0, second=0,
+                                           microsecond=0)
+            end_time = self.now.replace(hour=6, minute=59, second=59,
+                                        microsecond=0)
         return start_time, end_time
 
+    def read_journal(self, store, table, start_time, end_time,
+                     after_id=None):
+        """
+        Streams journal rows into a column store, a chunk at a time: station
+        columns go straight into uint8 arrays and submit_datetime into its
+        own datetime64 column.
+        :param store: (ColumnStore): Store to append to.
+        :param table: (Str): Journal table.
+        :param after_id: (Int): Only read rows past this id (None for all).
+        :return: Highest id read, or after_id if there were no rows.
+        """
+        columns = self.press.columns(table)
+        if after_id is None:
+            cursor = self.db.execute(range_statement(table, columns=columns),
+                                     (start_time, end_time))
+        else:
+            cursor = self.db.execute(range_statement(table, delta=True,
+                                                     columns=columns),
+                                     (after_id, start_time, end_time))
+        last_id = after_id
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            store.extend(np.array([row[1:-1] for row in rows],
+                                  dtype=np.uint8).transpose(),
+                         [row[-1] for row in rows])
+            last_id = rows[-1][0]
+        return last_id
+
     def sql_data_lists(self, table, start_time, end_time):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM {0} "
-                       "WHERE (submit_datetime > '{1}' "
-                       "AND submit_datetime < '{2}')"
-                       .format(table,
-                               start_time.strftime('%Y-%m-%d %H:%M:%S'),
-                               end_time.strftime('%Y-%m-%d %H:%M:%S')))
-        data = cursor.fetchall()
-        array = np.array(data)
-        column_lists = array.transpose().tolist()
-        try:
-            column_lists.pop(0)
-        except IndexError:
-            pass
-        return column_lists
+        store = ColumnStore(len(self.press.columns(table)) - 1)
+        self.read_journal(store, table, start_time, end_time)
+        return store
 
     def data_reset(self):
-        self.prod_lists = self.sql_data_lists('prs457_good_count_jnl',
-                                              *self.current_shift())
-        self.defect_lists = self.sql_data_lists('prs457_defect_code_jnl',
-                                                *self.current_shift())
+        # Starts the current shift empty and reads it from the server in the
+        # background, as a warm start with nothing cached would; see
+        # finish_reconcile. Replaces any catch-up still in flight, and never
+        # waits on the server, so a shift change with it down costs nothing.
+        self.shift = self.current_shift()
+        self._marks = {self.good_table: (None, 0),
+                       self.defect_table: (None, 0)}
+        self.prod_lists = []  # Drops the last shift, spilled cycles too.
+        self.defect_lists = []
+        self._read_behind()
+
+    def refresh(self):
+        """
+        Catches up with rows committed since the last read, by this terminal
+        or any other. Each table keeps a high-water mark: the last id read
+        and how many in-memory cycles were server rows at that point. Cycles
+        past the mark are rolled back, rows past the id are read and
+        appended, and rows still waiting to be written are put back on top,
+        so the cost follows the amount of new data rather than the length
+        of the shift.
+        :return: (Int): Server rows read.
+        """
+        if self._reconcile is not None:
+            return 0  # finish_reconcile will bring everything up to date.
+        # Holding flush_lock stops the writer committing in the meantime, so
+        # every row is either read from the server or still pending.
+        with self.journal.flush_lock:
+            return self.apply_delta(self.fetch_delta())
+
+    def fetch_delta(self):
+        """
+        Reads each table's rows past its high-water mark. Leaves the
+        in-memory shift alone, so it is safe to run on another thread.
+        :return: (dict): table: (ColumnStore of new rows, last id).
+        """
+        start_time, end_time = self.shift
+        delta = {}
+        for table in (self.good_table, self.defect_table):
+            rows = ColumnStore(len(self.press.columns(table)) - 1)
+            last_id = self.read_journal(rows, table, start_time, end_time,
+                                        self._marks[table][0])
+            delta[table] = (rows, last_id)
+        return delta
+
+    def apply_delta(self, delta):
+        """
+        Rolls each table back to its mark, appends the new server rows and
+        then the rows still waiting to be written.
+        :param delta: (dict): As returned by fetch_delta.
+        :return: (Int): Server rows applied.
+        """
+        start_time, end_time = self.shift
+        read = 0
+        for table, statement in ((self.good_table, self.good_insert),
+                                 (self.defect_table, self.defect_insert)):
+            store = self.table_store(table)
+            rows, last_id = delta[table]
+            mark = self._marks[table][1]
+            store.unspill(mark)  # Only if rows past the mark were spilled.
+            self._remove_aggregates(table, mark)
+            store.truncate(mark)
+            store.extend(rows.values, rows.times)
+            self._marks[table] = (last_id, len(store))
+            read += len(rows)
+            for row in self.pending_rows(statement):
+                if start_time < row[-1] < end_time:
+                    store.append(row[:-1], row[-1])
+            self._add_aggregates(table, mark)
+        self.retain()
+        self.changes.reload()
+        self.save_cache()
+        return read
+
+    def warm_start(self):
+        """
+        Loads the current shift from the local cache, if it holds it, and
+        starts reading newer rows from the server in the background. The
+        writer is held back until finish_reconcile has applied them, so
+        nothing gets committed in between.
+        :return: (Bool): True if the cache was used.
+        """
+        if self.cache is None:
+            return False
+        shift = self.current_shift()
+        stores = {table: ColumnStore(len(self.press.columns(table)) - 1)
+                  for table in (self.good_table, self.defect_table)}
+        marks = {}
+        for table, store in stores.items():
+            marks[table] = self.cache.load(table, shift[0], store)
+            if marks[table] is None:
+                return False
+        self.shift = shift
+        self._marks = marks
+        self.prod_lists = stores[self.good_table]
+        self.defect_lists = stores[self.defect_table]
+        self._read_behind()
+        return True
+
+    def _read_behind(self):
+        # Starts fetch_delta in the background, for finish_reconcile.
+        if self.pool is not None:
+            self._reconcile = self.pool.submit(self.fetch_delta)
+            return
+        executor = ThreadPoolExecutor(max_workers=1)
+        self._reconcile = executor.submit(self.fetch_delta)
+        executor.shutdown(wait=False)
+
+    def finish_reconcile(self, wait=False):
+        """
+        Applies the catch-up read started by warm_start or data_reset once
+        it is done, then starts the writer. Call from the GUI thread. If the
+        read failed its error is raised here; the writer still starts and
+        the next refresh catches up instead.
+        :param wait: (Bool): Wait for the read rather than returning if it
+        is still running.
+        :return: (Bool): True if the in-memory shift changed.
+        """
+        if self._reconcile is None or not (wait or self._reconcile.done()):
+            return False
+        future, self._reconcile = self._reconcile, None
+        try:
+            return self.apply_delta(future.result()) > 0
+        finally:
+            self.start_writer()
+            self.send_backlog()
+
+    def start_writer(self):
+        if self.writer.ident is None:
+            self.writer.start()
+
+    def save_cache(self):
+        # Keeps the local cache in step with the server-confirmed rows.
+        if self.cache is None:
+            return
+        for table, (last_id, mark) in self._marks.items():
+            self.cache.save(table, self.shift[0], self.table_store(table),
+                            last_id, mark)
+
+    def table_store(self, table):
+        if table == self.good_table:
+            return self._prod_store
+        return self._defect_store
+
+    def pending_rows(self, statement):
+        rows = self.writer.pending_rows(statement)
+        for cycle in list(self._backlog) + [self._cycle_rows]:
+            rows.extend(tuple(row) for row_statement, row in cycle
+                        if row_statement == statement)
+        return rows
+
+    def submit_cycle(self, prod_list, defect_list, submit_datetime=None):
+        """
+        Records one press cycle. The in-memory lists update immediately; both
+        journal rows go to the writer thread together, to be written in a
+        single transaction (or batched with later cycles when the server is
+        slow).
+        :param prod_list: (list): Good piece (0/1) per station.
+        :param defect_list: (list): Defect code per station.
+        :param submit_datetime: (datetime): Time of the stroke. Defaults to
+        now.
+        :return: No return.
+        """
+        self.submit_cycles([(prod_list, defect_list, submit_datetime)])
+
+    def submit_cycles(self, cycles):
+        """
+        Records several press cycles at once (e.g. strokes caught up after a
+        stall), handing all their rows to the writer as one batch.
+        :param cycles: (list): (prod_list, defect_list, submit_datetime)
+        for each cycle, oldest first.
+        :return: No return.
+        """
+        for prod_list, defect_list, submit_datetime in cycles:
+            self.prod_append(prod_list, submit_datetime)
+            self.defect_append(defect_list, submit_datetime)
+        self._backlog.append(self._cycle_rows)
+        self._cycle_rows = []
+        self.send_backlog()
+        self.retain()
+
+    def record_cycles(self, cycles):
+        """
+        Adds cycles already written by someone else (the collector) to the
+        in-memory shift only.
+        :param cycles: (list): As for submit_cycles.
+        :return: No return.
+        """
+        for prod_list, defect_list, submit_datetime in cycles:
+            self.prod_append(prod_list, submit_datetime)
+            self.defect_append(defect_list, submit_datetime)
+        self._cycle_rows = []
+        self.retain()
+
+    def shift_state(self):
+        """
+        A copy of the whole shift, spilled cycles included, for load_shift
+        in another process.
+        :return: (tuple): (shift, good count values, their times, defect
+        values, their times), the values as columns x cycles arrays.
+        """
+        prod_values, prod_times = self._prod_store.cycles()
+        defect_values, defect_times = self._defect_store.cycles()
+        return (self.shift, np.array(prod_values), np.array(prod_times),
+                np.array(defect_values), np.array(defect_times))
+
+    def load_shift(self, state):
+        """
+        Replaces the in-memory shift with one from shift_state.
+        :param state: (tuple): As returned by shift_state.
+        :return: No return.
+        """
+        self.shift, prod_values, prod_times, defect_values, defect_times = \
+            state
+        prod_store = ColumnStore(self.stations + 1)
+        prod_store.extend(prod_values, prod_times)
+        defect_store = ColumnStore(self.stations)
+        defect_store.extend(defect_values, defect_times)
+        self.prod_lists = prod_store
+        self.defect_lists = defect_store
+        self.retain()
+
+    def retain(self):
+        """
+        Keeps at most hot_cycles (plus a quarter, so spills come in chunks)
+        of each journal in memory, spilling the oldest to the store's file.
+        The totals already hold the spilled cycles; their expanding average
+        points are thinned out into a prefix of at most PREFIX_POINTS.
+        Cycles spilled before the server confirmed them are brought back by
+        apply_delta if it has to roll back past them.
+        :return: No return.
+        """
+        for table in (self.good_table, self.defect_table):
+            store = self.table_store(table)
+            if store.size <= self.hot_cycles + self.hot_cycles // 4:
+                continue
+            count = store.size - self.hot_cycles
+            if table == self.good_table:
+                self._spill_average(count)
+            store.spill(count, self.spill_dir)
+
+    def _spill_average(self, count):
+        # Moves the oldest count expanding average points into the prefix,
+        # keeping every stride-th cycle, and doubles the stride whenever the
+        # prefix outgrows PREFIX_POINTS.
+        cycles = np.arange(self._expand_avg.start,
+                           self._expand_avg.start + count)
+        kept = cycles % self._avg_stride == 0
+        self._avg_cycles = np.concatenate([self._avg_cycles, cycles[kept]])
+        spilled = self._expand_avg.values[:, :count]
+        self._avg_prefix = np.concatenate([self._avg_prefix,
+                                           spilled[:, kept]], axis=1)
+        while len(self._avg_cycles) > PREFIX_POINTS:
+            self._avg_stride *= 2
+            kept = self._avg_cycles % self._avg_stride == 0
+            self._avg_cycles = self._avg_cycles[kept]
+            self._avg_prefix = self._avg_prefix[:, kept]
+        self._expand_avg.drop(count)
+
+    def _truncate_average(self, cycles):
+        # Drops expanding average points from cycle index cycles on,
+        # including any in the prefix.
+        if cycles < self._expand_avg.start:
+            kept = self._avg_cycles < cycles
+            self._avg_cycles = self._avg_cycles[kept]
+            self._avg_prefix = self._avg_prefix[:, kept]
+        self._expand_avg.truncate(cycles)
+
+    def send_backlog(self):
+        # Hands held-back cycles to the writer, oldest first, until its queue
+        # is full again. Nothing goes until the warm start catch-up is in, as
+        # a shared writer may already be running for other presses.
+        while self._backlog and self._reconcile is None:
+            if not self.writer.submit(self._backlog[0]):
+                break
+            self._backlog.popleft()
+        return len(self._backlog)
+
+    @property
+    def write_depth(self):
+        # Cycles recorded in memory but not yet committed to the server.
+        return self.writer.depth + len(self._backlog)
+
+    def close(self):
+        self._prod_store.close()
+        self._defect_store.close()
+        if self.offline:
+            return
+        self._reconcile = None  # The backlog is written out regardless.
+        self.start_writer()  # Still needed to write out any backlog.
+        while self._backlog:  # All of it, however full the queue is; rows
+            # the writer can't commit go to its spool.
+            self.writer.submit(self._backlog.popleft(), force=True)
+        if self._shared:
+            return  # The writer's owner stops it and closes the rest.
+        self.writer.stop()
+        self.db.close()
+        if self.cache is not None:
+            self.cache.close()
 
     @staticmethod
     def set_list_of_lists(length, list_of_lists):
@@ -93,111 +1064,245 @@ class DataManager:
             self._prod_rate = rate
         return self._prod_rate
 
+    @staticmethod
+    def as_store(length, data):
+        if isinstance(data, ColumnStore):
+            assert data.columns == length - 1, \
+                "column store is wrong size for this table."
+            return data
+        return ColumnStore.from_lists(DataManager.set_list_of_lists(length,
+                                                                    data))
+
     @property
     def prod_lists(self):
-        return self._prod_lists
+        # Read-only views: stations 1-6, total_good, submit_datetime.
+        return self._prod_store.column_lists()
 
     @prod_lists.setter
-    def prod_lists(self, list_of_lists):
-        self._prod_lists = self.set_list_of_lists(8, list_of_lists)
+    def prod_lists(self, data):
+        if hasattr(self, '_prod_store'):
+            self._prod_store.close()
+        self._prod_store = self.as_store(self.stations + 2, data)
+        self.rebuild_prod_aggregates()
 
     @property
     def defect_lists(self):
-        return self._defect_lists
+        # Read-only views: stations 1-6, submit_datetime.
+        return self._defect_store.column_lists()
 
     @defect_lists.setter
-    def defect_lists(self, list_of_lists):
-        self._defect_lists = self.set_list_of_lists(7, list_of_lists)
+    def defect_lists(self, data):
+        if hasattr(self, '_defect_store'):
+            self._defect_store.close()
+        self._defect_store = self.as_store(self.stations + 1, data)
+        self.rebuild_defect_aggregates()
+
+    def rebuild_prod_aggregates(self):
+        # Running totals, rebuilt from scratch whenever prod_lists is replaced.
+        # prod_append and refresh keep them current after that.
+        self._cycles = 0
+        self._station_good = np.zeros(self.stations, dtype=np.int64)
+        self._press_good = 0
+        self._expand_avg = ColumnStore(self.stations, dtype=np.float64,
+                                       timestamps=False,
+                                       capacity=self._prod_store.capacity)
+        self._avg_cycles = np.zeros(0, dtype=np.int64)  # Spilled points
+        # kept for the chart, and their values (stations x points).
+        self._avg_prefix = np.zeros((self.stations, 0))
+        self._avg_stride = 1
+        self._add_aggregates(self.good_table, 0)
+        self.changes.reload()
+
+    def rebuild_defect_aggregates(self):
+        # Per station defect code counts, indexed by code (0-16).
+        self._defect_counts = np.zeros((self.stations, 17), dtype=np.int64)
+        self._add_aggregates(self.defect_table, 0)
+        self.changes.reload()
+
+    @staticmethod
+    def code_counts(codes):
+        """
+        Per station histogram of defect codes 0-16, in one bincount: each
+        station's codes are offset by 17 x its row, so every station gets
+        its own 17 bins.
+        :param codes: (array): Stations x cycles defect codes.
+        :return: (array): Stations x 17 counts, indexed by code.
+        """
+        stations = codes.shape[0]
+        offset = codes + 17 * np.arange(stations)[:, np.newaxis]
+        return np.bincount(offset.ravel(),
+                           minlength=17 * stations).reshape(stations, 17)
+
+    @staticmethod
+    def rank_codes(code_counts, top=3):
+        """
+        Each station's most frequent defect codes, for every station at
+        once. Most frequent first, lowest code first on ties (stable sort on
+        the negated counts). Code 0 is "no defect" and is never ranked, nor
+        is a code with no pieces.
+        :param code_counts: (array): Stations x 17 counts, as code_counts.
+        :param top: (Int): Codes to rank per station.
+        :return: (list): (codes, counts) per station, as lists.
+        """
+        ranked = np.argsort(-code_counts[:, 1:], axis=1,
+                            kind='stable')[:, :top] + 1
+        counts = np.take_along_axis(code_counts, ranked, axis=1)
+        return [(station_codes[station_counts > 0].tolist(),
+                 station_counts[station_counts > 0].tolist())
+                for station_codes, station_counts in zip(ranked, counts)]
 
-    def prod_append(self, prod_list):
-        assert len(prod_list) == 6, "prod_list is wrong size for this method."
+    def _add_aggregates(self, table, start):
+        # Folds the table's cycles from index start onwards into the totals.
+        values = self.table_store(table).since(start)[:self.stations]
+        count = values.shape[1]
+        if not count:
+            return
+        if table == self.defect_table:
+            self._defect_counts += self.code_counts(values)
+            return
+        running = (self._station_good[:, np.newaxis] +
+                   values.cumsum(axis=1, dtype=np.int64))
+        self._expand_avg.extend(running /
+                                np.arange(self._cycles + 1,
+                                          self._cycles + count + 1))
+        self._cycles += count
+        self._station_good = running[:, -1].copy()
+        self._press_good = int(self._station_good.sum())
+
+    def _remove_aggregates(self, table, start):
+        # Takes the table's cycles from index start onwards back out of the
+        # totals (the store itself is truncated by the caller).
+        values = self.table_store(table).since(start)[:self.stations]
+        count = values.shape[1]
+        if not count:
+            return
+        if table == self.defect_table:
+            self._defect_counts -= self.code_counts(values)
+            return
+        self._cycles -= count
+        self._station_good -= values.sum(axis=1, dtype=np.int64)
+        self._press_good = int(self._station_good.sum())
+        self._truncate_average(self._cycles)
+
+    def _update_prod_aggregates(self, cycle):
+        self._cycles += 1
+        self._station_good += cycle
+        self._press_good += int(sum(cycle))
+        self._expand_avg.append(self._station_good / self._cycles)
+
+    def _update_defect_aggregates(self, cycle):
+        self._defect_counts[np.arange(self.stations), cycle] += 1
+        for station, code in enumerate(cycle, 1):
+            if code:
+                self.changes.defect(station)
+
+    def take_changes(self):
+        # Stations whose charts changed since the last call; see
+        # ChangeTracker.take.
+        return self.changes.take(self)
+
+    def prod_append(self, prod_list, submit_datetime=None):
+        assert len(prod_list) == self.stations, \
+            "prod_list is wrong size for this method."
         for value in prod_list:
             assert 0 <= value <= 1, "list values are not 0 or 1, as expected"
-        good_cursor = self.conn.cursor()
+        if submit_datetime is None:
+            submit_datetime = self.now
         good_submit = list(prod_list)
-        good_submit.extend([sum(prod_list), self.now])
-        good_cursor.execute("INSERT INTO prs457_good_count_jnl(station_one, "
-                            "station_two, station_three, station_four, "
-                            "station_five, station_six, total_good, "
-                            "submit_datetime) "
-                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                            *good_submit)
-        good_cursor.commit()
-        good_cursor.close()
-        index = 0
-        for data_list in self._prod_lists:
-            data_list.append(good_submit[index])
-            index += 1
-
-    def defect_append(self, defect_list):
-        assert len(defect_list) == 6, \
+        good_submit.extend([sum(prod_list), submit_datetime])
+        self._cycle_rows.append((self.good_insert, good_submit))
+        self._prod_store.append(good_submit[:-1], submit_datetime)
+        self._update_prod_aggregates(prod_list)
+
+    def defect_append(self, defect_list, submit_datetime=None):
+        assert len(defect_list) == self.stations, \
             "prod_list is wrong size for this method."
         for value in defect_list:
             assert 0 <= value <= 16, \
                 "defect value is outside of expected range."
-        defect_cursor = self.conn.cursor()
+        if submit_datetime is None:
+            submit_datetime = self.now
         defect_submit = list(defect_list)
-        defect_submit.append(self.now)
-        defect_cursor.execute("INSERT INTO prs457_defect_code_jnl(station_one, "
-                              "station_two, station_three, station_four, "
-                              "station_five, station_six, submit_datetime) "
-                              "VALUES (?, ?, ?, ?, ?, ?, ?)",
-                              *defect_submit)
-        defect_cursor.commit()
-        defect_cursor.close()
-        index = 0
-        for data_list in self._defect_lists:
-            data_list.append(defect_submit[index])
-            index += 1
+        defect_submit.append(submit_datetime)
+        self._cycle_rows.append((self.defect_insert, defect_submit))
+        if self.rollup_upsert is not None:
+            # Same transaction as the journal rows: one piece per station.
+            hour = hour_of(submit_datetime)
+            for station, code in enumerate(defect_list, 1):
+                self._cycle_rows.append((self.rollup_upsert,
+                                         [hour, station, code, 1]))
+        self._defect_store.append(defect_list, submit_datetime)
+        self._update_defect_aggregates(defect_list)
+
+    def top_defects(self, top=3):
+        """
+        Every station's top defect codes this shift, ranked together.
+        :param top: (Int): Codes per station.
+        :return: (dict): Station number: (codes, piece counts).
+        """
+        return dict(enumerate(self.rank_codes(self._defect_counts, top), 1))
 
     def top_three_defect(self, station):
-        assert 1 <= station <= 6, "Station does not exist."
-        defect_data = self.defect_lists[station-1]
-        defect_count = pd.Series(defect_data).value_counts()
-        try:
-            defect_count.pop(0)
-        except KeyError:
-            pass
-        return defect_count.index.tolist()[:3], defect_count.tolist()[:3]
+        assert 1 <= station <= self.stations, "Station does not exist."
+        return self.rank_codes(self._defect_counts[station-1:station])[0]
 
     def expand_average_prod(self, station):
-        assert 1 <= station <= 6, "Station does not exist."
-        prod_data = self.prod_lists[station-1]
-        prod_expand_avg = pd.expanding_mean(pd.Series(prod_data))
-        return self.prod_lists[7], prod_expand_avg.tolist()
+        assert 1 <= station <= self.stations, "Station does not exist."
+        return self._prod_store.times, self._expand_avg.values[station-1]
+
+    def expand_average_series(self, station, points=None):
+        """
+        Expanding average for charting, downsampled with lttb to points
+        points (e.g. the chart's pixel width) once it is twice that long, so
+        plotting cost stays bounded however long the shift runs.
+        :param station: (Int): Press station 1-6
+        :param points: (Int): Points wanted; None for the full series.
+        :return: (tuple): (cycle indices, expanding average at each).
+        """
+        assert 1 <= station <= self.stations, "Station does not exist."
+        average = self._expand_avg.values[station-1]
+        cycles = np.arange(self._expand_avg.start, len(self._expand_avg))
+        if len(self._avg_cycles):
+            # Spilled cycles: the thinned prefix, then every cycle held.
+            cycles = np.concatenate([self._avg_cycles, cycles])
+            average = np.concatenate([self._avg_prefix[station-1], average])
+        if points is None or len(average) < 2 * points:
+            return cycles, average  # Cheap enough to draw as it is.
+        # Spilled cycles are _avg_stride apart, so lttb is given the cycle
+        # numbers rather than treating the points as evenly spaced.
+        kept, values = lttb(average, points, cycles)
+        return cycles[kept], values
+
+    def station_mean(self, station):
+        # Latest expanding average value for a station.
+        if not self._cycles:
+            return 0
+        return self._station_good[station-1] / self._cycles
 
     def station_sum_prod(self, station):
-        station_sum = sum(self.prod_lists[station-1])
-        return station_sum
+        return int(self._station_good[station-1])
 
     def press_sum_prod(self):
-        prod_list = []
-        for station in range(1, 7):
-            prod_list.append(self.station_sum_prod(station))
-
-        actual_prod = sum(prod_list)
-        return actual_prod
+        return self._press_good
 
     def press_cycles(self):
-        cycles = len(self.prod_lists[0])
-        return cycles
+        return self._cycles
 
     def percent_production(self):
-        prod_list = []
-        for station in range(1, 7):
-            prod_list.append(self.station_sum_prod(station))
-        percent_prod_list = []
-        if sum(prod_list) == 0:
-            return [0, 0, 0, 0, 0, 0]
+        if self._press_good == 0:
+            return [0] * self.stations
         else:
-            for prod in prod_list:
-                percent_prod_list.append(prod/sum(prod_list))
-            return percent_prod_list
+            return (self._station_good / self._press_good).tolist()
 
     def production_summary(self, actual_rate):
+        """
+        :param actual_rate: (Float): Current cycle time, seconds.
+        :return: (tuple): Ideal, ideal with breaks, best case, produced
+        (with rejects) and good production.
+        """
         MIN_PER_HR = 60
         SEC_PER_MIN = 60
-        PCS_PER_CYCLE = 6
+        PCS_PER_CYCLE = self.stations
 
         nominal_production = (self.hours_per_shift * MIN_PER_HR * SEC_PER_MIN /
                               self.nameplate) * PCS_PER_CYCLE
@@ -207,7 +1312,7 @@ class DataManager:
 
         ideal_actual_prod = nom_prod_w_breaks * self.nameplate / actual_rate
 
-        actual_prod_w_reject = self.press_cycles() * 6
+        actual_prod_w_reject = self.press_cycles() * self.stations
 
         actual_prod = self.press_sum_prod()
 
@@ -215,6 +1320,158 @@ class DataManager:
                 math.floor(ideal_actual_prod), actual_prod_w_reject,
                 actual_prod)
 
+    def snapshot(self, cycle_time, rolling_rate=None, points=None):
+        """
+        Everything the dashboard shows, computed once. Takes the changes
+        since the last call (as take_changes), so only one display should
+        take snapshots from a data manager.
+        :param cycle_time: (Float): Last cycle time, seconds.
+        :param rolling_rate: (Float): Rolling cycle time for the summary.
+        Defaults to cycle_time.
+        :param points: (Int): Most points per expanding average series, as
+        for expand_average_series.
+        :return: (DashboardSnapshot)
+        """
+        if rolling_rate is None:
+            rolling_rate = cycle_time
+        rankings, series = self.take_changes()
+        station_good = tuple(self._station_good.tolist())
+        if self._press_good:
+            percent = tuple((self._station_good /
+                             self._press_good).tolist())
+        else:
+            percent = (0,) * self.stations
+        top_defects = tuple((tuple(codes), tuple(counts)) for codes, counts
+                            in self.rank_codes(self._defect_counts))
+        shown_series = []
+        for station in series:
+            cycles, average = self.expand_average_series(station, points)
+            cycles, average = np.array(cycles), np.array(average)
+            cycles.flags.writeable = average.flags.writeable = False
+            shown_series.append((station, cycles, average))
+        return DashboardSnapshot(tuple(self.shift), self._cycles,
+                                 self._press_good, station_good, percent,
+                                 top_defects,
+                                 self.production_summary(rolling_rate),
+                                 cycle_time, rolling_rate, tuple(rankings),
+                                 tuple(shown_series))
+
+    def report_bucket(self, bucket, column='submit_datetime'):
+        # The server's expression for a report bucket name.
+        if bucket is None:
+            return None
+        assert bucket in BUCKET_HOURS, "Report bucket does not exist."
+        return REPORT_BUCKETS[self.db.dialect][bucket].format(column)
+
+    @staticmethod
+    def bucket_start(value):
+        # SQLite returns bucket starts as text.
+        if isinstance(value, str):
+            return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+        return value
+
+    def run_report(self, statement, params, bucket):
+        """
+        Runs a report statement; only result rows cross the wire.
+        :return: (list): (bucket start, rest of the row) per row, sorted.
+        """
+        rows = self.db.execute(statement, params).fetchall()
+        if bucket is None:
+            return [(None, tuple(row)) for row in rows]
+        return sorted((self.bucket_start(row[0]), tuple(row[1:]))
+                      for row in rows)
+
+    def good_report(self, start_time, end_time, bucket=None):
+        """
+        Good pieces per station over any time range, summed by the server.
+        :param start_time: (datetime): Range start, inclusive.
+        :param end_time: (datetime): Range end, exclusive.
+        :param bucket: (Str): 'hour', 'shift' or 'day' to split the range,
+        or None for one total.
+        :return: (list): (bucket start, good count per station, total good,
+        cycles) for each bucket with cycles, oldest first. Bucket start is
+        None without a bucket.
+        """
+        columns = self.press.station_columns + ('total_good',)
+        select = ', '.join('SUM(CAST({0} AS INT))'.format(column)
+                           for column in columns) + ', COUNT(*)'
+        statement = report_statement(self.good_table, select,
+                                     self.report_bucket(bucket))
+        return [(start, [int(value or 0) for value in values[:-2]],
+                 int(values[-2] or 0), int(values[-1]))
+                for start, values in self.run_report(
+                        statement, (start_time, end_time), bucket)
+                if values[-1]]
+
+    def defect_report(self, start_time, end_time, bucket=None):
+        """
+        Defect counts per station and code over any time range (e.g. a
+        Pareto), counted by the server.
+        :param bucket: (Str): As for good_report.
+        :return: (list): (bucket start, station, defect code, count), by
+        bucket and station, most frequent code first (lowest code on
+        ties). Code 0 (no defect) is left out.
+        """
+        bucket_sql = self.report_bucket(bucket)
+        statement = ' UNION ALL '.join(
+                report_statement(self.defect_table,
+                                 '{0} AS station, {1} AS code, COUNT(*)'
+                                 .format(station, column),
+                                 bucket_sql, column + ' <> 0', column)
+                for station, column in enumerate(self.press.station_columns,
+                                                 1))
+        rows = [(start, int(station), int(code), int(count))
+                for start, (station, code, count) in self.run_report(
+                        statement, (start_time, end_time) * self.stations,
+                        bucket)]
+        rows.sort(key=lambda row: (row[0] or start_time, row[1], -row[3],
+                                   row[2]))
+        return rows
+
+    def rollup_report(self, start_time, end_time, bucket='hour'):
+        """
+        Pieces per station and defect code from the hourly rollup: a few
+        rows per hour instead of a scan of the journals. Code 0 counts good
+        pieces, and the pieces of any one station add up to the cycles.
+        :param start_time: (datetime): Range start, inclusive; whole hours.
+        :param end_time: (datetime): Range end, exclusive; whole hours.
+        :param bucket: (Str): 'hour', 'shift', 'day' or None, as for
+        good_report.
+        :return: (list): (bucket start, station, defect code, pieces), by
+        bucket, station and code.
+        """
+        assert self.press.rollup_table, "Press has no rollup table."
+        statement = report_statement(self.press.rollup_table,
+                                     'station, defect_code, SUM(pieces)',
+                                     self.report_bucket(bucket,
+                                                        'hour_start'),
+                                     group='station, defect_code',
+                                     column='hour_start')
+        rows = [(start, int(station), int(code), int(pieces))
+                for start, (station, code, pieces) in self.run_report(
+                        statement, (start_time, end_time), bucket)]
+        rows.sort(key=lambda row: (row[0] or start_time,) + row[1:3])
+        return rows
+
+    def cycle_report(self, start_time, end_time, bucket='hour'):
+        """
+        Press cycles over any time range, counted by the server.
+        :param bucket: (Str): As for good_report.
+        :return: (list): (bucket start, cycles, cycles per hour) for each
+        bucket with cycles, oldest first. The rate is over the whole
+        bucket, so buckets only partly inside the range read low.
+        """
+        if bucket is None:
+            hours = (end_time - start_time).total_seconds() / 3600
+        else:
+            hours = BUCKET_HOURS[bucket]
+        statement = report_statement(self.good_table, 'COUNT(*)',
+                                     self.report_bucket(bucket))
+        return [(start, int(count), int(count) / hours)
+                for start, (count,) in self.run_report(
+                        statement, (start_time, end_time), bucket)
+                if count]
+
 
 
 if __name__ == '__main__':
@@ -1,37 +1,103 @@
-from PyQt4.uic import loadUiType
+from cycle_metrics import StartupTimer, CycleMetrics, METRICS_DIR
+startup_timer = StartupTimer()  # Before the imports, so they're timed too.
+import os
 from PyQt4 import QtGui, QtCore
-import pyodbc
 from datetime import datetime
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as \
-    FigureCanvas
-import smith_data as sd
-import signal_reader as sr
-from matplotlib.pyplot import style
-import math
-import os
-
-os.startfile('C:/smiths_micrologix_data/connector.py')
-style.use('bmh')
-
-Ui_main, Qmain = loadUiType('ui/main.ui')
+import collector
+from ui_form import load_form
+
+startup_timer.mark('qt_import')
+Ui_main, Qmain = load_form()  # Compiled once; see ui_form.py.
+startup_timer.mark('ui_form')
+
+# smith_data (NumPy) and the matplotlib modules are imported by
+# Main.finish_startup, once the window is up.
+
+SHIFT_WAIT = 5000  # ms after connecting for the press's shift to arrive.
+
+
+class CollectorLink(QtCore.QThread):
+    """
+    The dashboard's subscription to the collector (see collector.py).
+    Receives on its own thread and hands each message to the GUI thread as
+    a signal (cross-thread emits are queued by Qt). Starts the collector if
+    none is running, and reconnects if it goes away.
+    """
+    received = QtCore.pyqtSignal(object)  # A published message.
+    status = QtCore.pyqtSignal(str)  # Connection state, for the status bar.
+    connected = QtCore.pyqtSignal()  # Each time a connection is made.
+
+    def __init__(self, retry=2.0):
+        super(CollectorLink, self).__init__()
+        self.retry = retry
+        self.conn = None
+        self._stopping = False
+
+    def run(self):
+        process = None  # The collector started from here, until it answers.
+        while not self._stopping:
+            try:
+                self.conn = collector.connect()
+            except OSError:
+                # Only while none started from here is still coming up; one
+                # that exited (crashed, or found another running) is retried.
+                if process is None or process.poll() is not None:
+                    process = collector.launch()
+                    self.status.emit('Starting the cycle collector...')
+                self.msleep(int(self.retry * 1000))
+                continue
+            process = None  # Should it go away later, start another.
+            self.status.emit('Connected to the cycle collector.')
+            self.connected.emit()
+            try:
+                while True:
+                    self.received.emit(self.conn.recv())
+            except (OSError, EOFError):
+                self.conn = None
+                if not self._stopping:
+                    self.status.emit('Lost the cycle collector, '
+                                     'reconnecting...')
+
+    def send(self, message):
+        # False if not connected; the state is sent again on reconnecting.
+        conn = self.conn
+        if conn is None:
+            return False
+        try:
+            conn.send(message)
+            return True
+        except (OSError, EOFError):
+            return False
+
+    def stop(self):
+        self._stopping = True
+        if self.conn is not None:
+            self.conn.close()
 
 
 class Main(Qmain, Ui_main):
-    def __init__(self):
+    def __init__(self, press_name=None):
+        """
+        :param press_name: (Str): Press to show, e.g. from the command line.
+        Defaults to the first one in presses.json.
+        """
         self.now = datetime.now() # Current time
-        # Database connection.
-        self.conn = pyodbc.connect('DRIVER={SQL Server};'
-                                   'SERVER=ZIRSYSPRO;'
-                                   'DATABASE=MAINTDATA;'
-                                   'Trusted_Connection=yes')
-
-        self.data = sd.DataManager()    # Separate class created to manage the
-        # data aspect of the application.
-
-        self.signal = sr.SignalReader()
-
-        self.cycle_time = self.signal.update_cycle()
+        self.data = None  # Made by finish_startup: a sd.DataManager,
+        # a copy of the collector's shift, kept for the charts. Strokes are
+        # counted and written by the collector process.
+        self.press_name = press_name
+        self.press = None  # Name of the press shown, from self.data.
+        self.shift_seen = False  # The collector has sent the press's shift
+        # since connecting.
+        self.snapshot = None  # The sd.DashboardSnapshot last shown.
+
+        self.cycle_time = 26  # Until the collector sends the measured ones.
+        self.rolling_rate = self.cycle_time
+        self.cycle_summary = None  # cycle_stats.CycleSummary, shown on the
+        # cycle time's tooltip.
+
+        self.metrics = CycleMetrics('dashboard')  # Stage timing for each
+        # cycle shown (PRESS_METRICS=off to disable).
 
         super(Main, self).__init__() # Inherit parent methods...I think?
         self.setupUi(self) # I don't know what this is.
@@ -55,16 +121,18 @@ class Main(Qmain, Ui_main):
         self.station_on = {1: True, 2: True, 3: True, 4: True, 5: True,
                            6: True} # Used for station on/off toggles.
 
-        self.update_display()  # Used to run charts and values for the first
-        # time.
-
-        self.current_shift = self.data.current_shift()  # Used to determine the
-        # current shift and update data accordingly
+        self.placeholders = self.add_placeholders()  # Shown where the
+        # charts go until build_charts replaces them.
 
-        self.timer = QtCore.QTimer()  # PyQt timer action signal.
-        self.timer.start(1000)  # Trigger a signal every second.
-        self.timer.timeout.connect(self.cycle_check)  # perform action
-        # trigger.
+        self.link = CollectorLink()  # Shift, cycles and journal status
+        # from the collector; operator entries go back through it. Started
+        # by finish_startup.
+        self.link.received.connect(self.collector_message)
+        self.link.status.connect(self.statusbar.showMessage)
+        self.link.connected.connect(self.expect_shift)
+        self.press_label = QtGui.QLabel()  # The press shown, or why it
+        # isn't; kept apart from the status messages.
+        self.statusbar.addPermanentWidget(self.press_label)
 
         self.new_entry = self.cycle_time  # New entry is used as a trigger to
         # reset input. Another jumper aspect for program.
@@ -72,31 +140,153 @@ class Main(Qmain, Ui_main):
         self._want_to_close = False  # True: Can close program with 'X'. False:
         # Can only minimize program
 
-    def cycle_check(self):
+        startup_timer.mark('window')
+        # The rest runs once the event loop has shown the window.
+        QtCore.QTimer.singleShot(0, self.finish_startup)
+
+    def finish_startup(self):
         """
-        The current event triggered on the timer. Runs the jumper function to
-        reset cycle.
-        :return: No return
+        Second half of startup, after the window is on screen: imports the
+        data and chart modules, swaps the placeholders for charts, and
+        subscribes to the collector, whose shift then fills the charts in.
+        Ends by saving the startup timing report.
+        :return: No return.
         """
-        if self.signal.signal_changed(1):
-            self.cycle_time = self.signal.update_cycle()
-            self.submit_data()
+        QtGui.QApplication.processEvents()  # Paint the window first.
+        startup_timer.mark('window_shown')
+        import smith_data as sd
+        import presses
+        press = presses.choose(self.press_name)
+        if press is None:
+            press = presses.choose()
+            self.statusbar.showMessage(
+                'No press {0} in presses.json, showing {1}.'
+                .format(self.press_name, press.name))
+        self.data = sd.DataManager(press=press, offline=True)
+        self.press = press.name
+        self.press_label.setText(self.press)
+        startup_timer.mark('data_import')
+
+        self.build_charts()  # Charts and canvases are made once, then
+        # updated in place.
+        startup_timer.mark('charts')
+
+        self.update_display()  # Used to run charts and values for the first
+        # time.
+        startup_timer.mark('first_display')
+
+        self.link.start()
+        self.statusbar.showMessage('Started in {0:.1f} s.'
+                                   .format(startup_timer.total))
+        startup_timer.save(os.path.join(METRICS_DIR, 'dashboard_startup.log'))
+
+    def collector_message(self, message):
+        """
+        Slot for messages from the collector. A shift replaces the copy held
+        here; cycles are added to it, and end the operator's current entry.
+        :param message: (tuple): See collector.py.
+        :return: No return.
+        """
+        kind = message[0]
+        if kind == 'written':
+            self.journal_written(*message[1:])
+        elif kind == 'failed':
+            self.journal_failed(*message[1:])
+        elif message[1] != self.press:
+            return
+        elif kind == 'shift':
+            self.shift_seen = True
+            self.press_label.setText(self.press)
+            self.data.load_shift(message[2])
+            self.cycle_time, self.rolling_rate = message[3:]
+            self.send_input()  # The collector may be newly (re)started.
             self.update_display()
-            # Check if shift change, and update list if so.
-            if self.current_shift != self.data.current_shift():
-                self.current_shift = self.data.current_shift()
-                self.data.data_reset()
+        elif kind == 'cycles':
+            self.metrics.start()
+            strokes = message[2]
+            self.data.record_cycles(strokes)
+            self.cycle_time, self.rolling_rate = message[3:]
+            self.metrics.lap('mirror')
+            self.reset_count()
+            self.update_display()
+            self.metrics.lap('display')
+            self.metrics.end(self.press)
+            if len(strokes) > 1:
+                self.statusbar.showMessage(
+                    'Recorded {0} strokes missed since the last check.'
+                    .format(len(strokes) - 1))
+        elif kind == 'cycle_stats':
+            self.cycle_summary = message[2]
+            self.cycle_stats_tip()
+        self.metrics.maybe_export()
+
+    def expect_shift(self):
+        # The collector sends every press's shift on connecting, so if this
+        # press's doesn't come, the collector doesn't track it.
+        self.shift_seen = False
+        QtCore.QTimer.singleShot(SHIFT_WAIT, self.check_shift_seen)
+
+    def check_shift_seen(self):
+        if self.shift_seen or self.link.conn is None:
+            return
+        self.press_label.setText(
+            '{0}: not tracked by the cycle collector (see presses.json)'
+            .format(self.press))
+
+    def cycle_stats_tip(self):
+        """
+        Shows the measured cycle times and the shift's short, slow and
+        stopped cycles on the cycle time's tooltip.
+        :return: No return.
+        """
+        summary = self.cycle_summary
+        if summary.rate is None:
+            tip = 'No cycles measured yet.'
+        else:
+            tip = ('Rolling mean {0:.1f} s, median {1:.1f} s, 90% {2:.1f} s'
+                   .format(summary.rate, summary.median, summary.p90))
+        tip += ('\nThis shift: {0} cycles, {1} short, {2} slow, {3} stops'
+                .format(summary.cycles, summary.short, summary.slow,
+                        summary.stops))
+        self.cycleTimeDisp.setToolTip(tip)
+
+    def send_input(self):
+        """
+        Sends the operator's entry for the next stroke, and the station and
+        startup toggles, to the collector.
+        :return: No return.
+        """
+        self.link.send(('baseline', self.press,
+                        [self.station_on[station] for station in range(1, 7)],
+                        self.startup))
+        self.link.send(('next_cycle', self.press, list(self.good_pieces),
+                        list(self.defect_list)))
 
-    def submit_data(self):
+    def journal_written(self, rows, seconds, depth):
         """
-        Sends cycle data (production and defect) to the data handling class.
-        Resets the cycle count with the reset_count method.
+        Called for the collector's journal writer's written message. Shows
+        write latency and the number of cycles still waiting to be
+        committed.
+        :param rows: (Int): Rows committed by the flush.
+        :param seconds: (Float): Time the flush took.
+        :param depth: (Int): Cycles still queued in the writer.
         :return: No return.
         """
-        self.data.prod_append(self.good_pieces)
-        self.data.defect_append(self.defect_list)
+        self.statusbar.showMessage(
+            'Journal: {0} rows written in {1} ms, {2} cycles queued'
+            .format(rows, round(seconds * 1000), depth))
 
-        self.reset_count()
+    def journal_failed(self, message, depth):
+        """
+        Called for the collector's journal writer's failed message. Rows stay
+        queued and are retried by the writer.
+        :param message: (Str): Database error.
+        :param depth: (Int): Cycles still queued in the writer.
+        :return: No return.
+        """
+        self.statusbar.showMessage(
+            'Journal write failed, {0} cycles queued: {1}'
+            .format(depth, message))
 
     def reset_count(self):
         """
@@ -135,6 +325,7 @@ class Main(Qmain, Ui_main):
             # Reset cycle values.
             self.defect_list[station-1] = 0
             self.good_pieces[station-1] = 1
+            self.send_input()
 
     def defect_toggle(self, clicked, code, station):
         """
@@ -158,6 +349,7 @@ class Main(Qmain, Ui_main):
             self.good_pieces[station-1] = 1
             for dict_code, button in self.station_dict[station].items():
                 button.setEnabled(True)
+        self.send_input()
 
     def station_toggle(self, station, clicked):
         """
@@ -181,6 +373,7 @@ class Main(Qmain, Ui_main):
             self.station_on[station] = True
             self.good_pieces[station-1] = 1
             self.defect_list[station-1] = 0
+        self.send_input()
 
     def startup_toggle(self, clicked):
         """
@@ -202,188 +395,140 @@ class Main(Qmain, Ui_main):
             self.defect_list = [0, 0, 0, 0, 0, 0]
             for station in range(1, 7):
                 self.station_defect_dict[station].setEnabled(True)
-
-    def add_mpl(self, plot, layout):
-        """
-        Helper function for plot updating. I believe this could be a static
-        method, but I'm not clear on how to appropriately use static methods
-        yet.
-        :param plot: (matplotlib figure): Figure to be added to a layout.
+        self.send_input()
+
+    def chart_layouts(self):
+        # Every layout that holds a chart.
+        return (list(self.top_three_layout_dict.values()) +
+                list(self.exp_avg_layout_dict.values()) +
+                [self.mplvlProdPercent, self.mplvlProdSum])
+
+    def add_placeholders(self):
+        """
+        Puts a 'Loading' label where each chart goes, so the window can be
+        shown before matplotlib is imported.
+        :return: (dict): The labels, by layout.
+        """
+        placeholders = {}
+        for layout in self.chart_layouts():
+            label = QtGui.QLabel('Loading...')
+            label.setAlignment(QtCore.Qt.AlignCenter)
+            layout.addWidget(label)
+            placeholders[layout] = label
+        return placeholders
+
+    def add_mpl(self, chart, layout):
+        """
+        Helper function for chart setup. Puts a chart's figure on a canvas
+        in a layout, once, in place of its placeholder; later updates redraw
+        that same canvas.
+        :param chart: (charts.Chart): Chart to be added to a layout.
         :param layout: (class layout): Layout in which to add the figure.
-        :return: No return
-        """
-        canvas = FigureCanvas(plot)
+        :return: (charts.Chart): The chart.
+        """
+        from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg \
+            as FigureCanvas
+        placeholder = self.placeholders.pop(layout, None)
+        if placeholder is not None:
+            layout.removeWidget(placeholder)
+            placeholder.deleteLater()
+        canvas = FigureCanvas(chart.fig)
         layout.addWidget(canvas)
-        canvas.draw()
+        return chart
 
-    def clear_layout(self, layout):
+    def build_charts(self):
         """
-        Helper function for plot updating. Clears a layout to allow for update
-        replacement.
-        :param layout: (class layout): Layout to be cleared.
-        :return:  No return.
-        """
-        while layout.count():
-            child = layout.takeAt(0)
-            child.widget().deleteLater()
-
-    def update_layout(self, plot, layout):
-        """
-        Applied the clear_layout and add_mpl functions in sequence to update a
-        plot.
-        :param plot: (matplotlib figure): Figure to be added to a layout.
-        :param layout: (class layout): Layout in which to add the figure.
+        Creates every chart and its canvas once, at startup. matplotlib is
+        first imported here.
         :return: No return.
         """
-        self.clear_layout(layout)
-        self.add_mpl(plot, layout)
+        from matplotlib import style
+        import charts
+        style.use('bmh')
+        self.top_three_charts = {}
+        self.exp_avg_charts = {}
+        for station in range(1, 7):
+            self.top_three_charts[station] = self.add_mpl(
+                    charts.TopThreeChart(),
+                    self.top_three_layout_dict[station])
+            self.exp_avg_charts[station] = self.add_mpl(
+                    charts.ExpandingAverageChart(),
+                    self.exp_avg_layout_dict[station])
+        self.percent_chart = self.add_mpl(charts.PercentPerformanceChart(),
+                                          self.mplvlProdPercent)
+        self.summary_chart = self.add_mpl(charts.ProdSummaryChart(),
+                                          self.mplvlProdSum)
 
     def update_display(self):
         """
-        Contains all items to be updated during every refresh. (All graphs,
-        and the production value.
+        Contains all items to be updated during every refresh. Everything
+        shown comes from one snapshot of the data manager, taken here.
+        Station charts are only redrawn when the snapshot reports they
+        changed; the summary charts and values are updated every time.
         :return: No return.
         """
-        self.update_layout(self.top_three_plot(1), self.mplvlTopThree_1)
-        self.update_layout(self.top_three_plot(2), self.mplvlTopThree_2)
-        self.update_layout(self.top_three_plot(3), self.mplvlTopThree_3)
-        self.update_layout(self.top_three_plot(4), self.mplvlTopThree_4)
-        self.update_layout(self.top_three_plot(5), self.mplvlTopThree_5)
-        self.update_layout(self.top_three_plot(6), self.mplvlTopThree_6)
-
-        self.update_layout(self.expanding_average_plot(1), self.mplvlExpAvg_1)
-        self.update_layout(self.expanding_average_plot(2), self.mplvlExpAvg_2)
-        self.update_layout(self.expanding_average_plot(3), self.mplvlExpAvg_3)
-        self.update_layout(self.expanding_average_plot(4), self.mplvlExpAvg_4)
-        self.update_layout(self.expanding_average_plot(5), self.mplvlExpAvg_5)
-        self.update_layout(self.expanding_average_plot(6), self.mplvlExpAvg_6)
-
-        self.update_layout(self.percent_performance_plot(),
-                           self.mplvlProdPercent)
+        points = max(chart.pixel_width()
+                     for chart in self.exp_avg_charts.values())
+        self.snapshot = snapshot = self.data.snapshot(
+                self.cycle_time, self.rolling_rate, points)
+        for station in snapshot.changed_rankings:
+            self.top_three_plot(station, snapshot.top_defects[station-1])
+        for station, cycles, average in snapshot.series:
+            self.expanding_average_plot(station, cycles, average)
 
-        self.update_layout(self.prod_summary_chart(), self.mplvlProdSum)
+        self.percent_performance_plot(snapshot)
+        self.prod_summary_chart(snapshot)
 
-        self.prodDisp.setText(str(self.data.press_sum_prod()))
-        self.cycleTimeDisp.setText(str(round(self.cycle_time, 1)))
+        self.prodDisp.setText(str(snapshot.press_good))
+        self.cycleTimeDisp.setText(str(round(snapshot.cycle_time, 1)))
 
-    def top_three_plot(self, station):
+    def top_three_plot(self, station, ranking):
         """
         Method for the bar chart displayed for each station. Displays the top
         three defects of each station
         :param station: (Int): Press station 1-6
-        :return: matplotlib figure.
+        :param ranking: (tuple): The station's (codes, counts), from
+        DashboardSnapshot.top_defects.
+        :return: No return.
         """
-        fig = Figure(frameon=False)
-        codes, counts = self.data.top_three_defect(station)
-
-        # Order bar chart in a row, based on number of codes.
-        x_axis = range(len(counts))
-
-        ax = fig.add_subplot(111)
-        ax.bar(x_axis, counts, align='center', color='darkred')
-
-        # Set labels for x axis.
-        x_labels = []
-        for code in codes:
-            x_labels.append(str(code))
-        ax.set_xticks(x_axis)
-        ax.set_xticklabels(x_labels)
+        chart = self.top_three_charts[station]
+        chart.update(*ranking)
+        chart.redraw()
 
-        # Customized y-axis display.
-        try:
-            high_count = max(counts)
-        except ValueError:
-            high_count = 0
-        y_int = range(4)
-        if 1 <= high_count <= 10:
-            y_int = range(0, high_count + 2)
-        elif 11 <= high_count <= 100:
-            y_int = range(0, high_count + 2, math.ceil(high_count/10))
-        ax.set_yticks(y_int)
-
-        return fig
-
-    def expanding_average_plot(self, station):
+    def expanding_average_plot(self, station, cycles, average):
         """
         Method for the line chart displayed on each station. Updates with the
         expanding average over the shift.
         :param station: (Int): Press station 1-6
-        :return: matplotlib figure
+        :param cycles: (array): Cycle index of each point.
+        :param average: (array): Expanding average, downsampled to the
+        chart's width (DashboardSnapshot.series).
+        :return: No return.
         """
-        fig = Figure(frameon=False)
-        dates, average = self.data.expand_average_prod(station)
-        ax = fig.add_subplot(111)
-        ax.plot(range(len(average)), average, color='red')
-        ax.set_ylim(bottom=0)
-        ax.get_xaxis().set_visible(False)
+        chart = self.exp_avg_charts[station]
+        chart.update(average, cycles)
+        chart.redraw()
 
-        return fig
-
-    def percent_performance_plot(self):
+    def percent_performance_plot(self, snapshot):
         """
         Method for the bar chart displayed at the top of the application.
         Displays the relative production of each station.
-        :return: matplotlib figure.
+        :param snapshot: (DashboardSnapshot): Values to show.
+        :return: No return.
         """
-        fig = Figure(frameon=False)
-        fig.subplots_adjust(left=.03, right=.97)
-        prod_percents = self.data.percent_production()
-        ax = fig.add_subplot(111)
-        ax.bar(range(1, 7), prod_percents, align='center', color='darkred')
-        ax.set_ylim(bottom=0)
-        ax.set_xticks([1, 2, 3, 4, 5, 6])
+        self.percent_chart.update(snapshot.percent)
+        self.percent_chart.redraw()
 
-        return fig
-
-    def prod_summary_chart(self):
+    def prod_summary_chart(self, snapshot):
         """
         Method for the progress bar displayed at the bottom of the application.
         Displays ideal production, best-case production, actual production, and
         rejects. Tracks throughout shift.
-        :return: matplotlib figure.
-        """
-        fig = Figure(frameon=False)
-        prod_data = self.data.production_summary(self.cycle_time)
-        ax = fig.add_subplot(111)
-        fig.subplots_adjust(top=.75, bottom=.25, right=.95, left=.05)
-
-        ax.barh(0, prod_data[0], facecolor='.6')
-        ax.annotate("Ideal: " + str(prod_data[0]), (prod_data[0], .5),
-                    xytext=(prod_data[0], -.12), va="top", ha="right",
-                    arrowprops=dict(arrowstyle="->"))
-        ax.barh(0, prod_data[1], facecolor='.8')
-        ax.annotate("Ideal (w/ Breaks): " + str(prod_data[1]),
-                    (prod_data[1], .5), xytext=(prod_data[1], .88),
-                    va="bottom", ha="right", arrowprops=dict(arrowstyle="->"))
-        ax.barh(0, prod_data[2], facecolor='.5')
-        ax.annotate("Best Case: " + str(prod_data[2]), (prod_data[2], .5),
-                    xytext=(prod_data[2], -.12), va="top", ha="right",
-                    arrowprops=dict(arrowstyle="->"))
-
-        ax.barh(0, prod_data[3], facecolor='red')
-        try:
-            defect_percent = round((prod_data[3] - prod_data[4]) * 100 /
-                                   prod_data[3], 1)
-        except ZeroDivisionError:
-            defect_percent = 0.0
-        ax.annotate("Defects: " + str(prod_data[3] - prod_data[4]) + " (" +
-                    str(defect_percent) + "%)",
-                    (prod_data[3], .5), xytext=(prod_data[3], .88),
-                    va="bottom", ha="center", arrowprops=dict(arrowstyle="->"))
-
-        ax.barh(0, prod_data[4], facecolor='darkred')
-        try:
-            prod_percent = round(prod_data[4] * 100 / prod_data[2], 1)
-        except ZeroDivisionError:
-            prod_percent = 0.0
-        ax.annotate("Shift: " + str(prod_data[4]) + " (" + str(prod_percent) +
-                    "%)", (prod_data[4], .5), xytext=(prod_data[4], -.12),
-                    va="top", ha="center", arrowprops=dict(arrowstyle="->"))
-
-        ax.set_xlim(left=0, right=prod_data[0])
-        ax.axis('off')
-
-        return fig
+        :param snapshot: (DashboardSnapshot): Values to show.
+        :return: No return.
+        """
+        self.summary_chart.update(snapshot.summary)
+        self.summary_chart.redraw()
 
     def widget_dicts(self):
         # Contains all dicts used in the class, for cleanliness.
@@ -477,6 +622,20 @@ class Main(Qmain, Ui_main):
                               13: self.pushButtonPieceDropped_6,
                               }
 
+        self.top_three_layout_dict = {1: self.mplvlTopThree_1,
+                                      2: self.mplvlTopThree_2,
+                                      3: self.mplvlTopThree_3,
+                                      4: self.mplvlTopThree_4,
+                                      5: self.mplvlTopThree_5,
+                                      6: self.mplvlTopThree_6,}
+
+        self.exp_avg_layout_dict = {1: self.mplvlExpAvg_1,
+                                    2: self.mplvlExpAvg_2,
+                                    3: self.mplvlExpAvg_3,
+                                    4: self.mplvlExpAvg_4,
+                                    5: self.mplvlExpAvg_5,
+                                    6: self.mplvlExpAvg_6,}
+
         self.station_dict = {1: self.defect_dict_1, 2: self.defect_dict_2,
                              3: self.defect_dict_3, 4: self.defect_dict_4,
                              5: self.defect_dict_5, 6: self.defect_dict_6,
@@ -549,7 +708,10 @@ class Main(Qmain, Ui_main):
         :return: No return
         """
         if self._want_to_close:
-            self.conn.close()
+            self.link.stop()
+            if self.data is not None:
+                self.data.close()
+            self.metrics.export()
             super(Main, self).closeEvent(event)
         else:
             event.ignore()
@@ -559,7 +721,7 @@ if __name__ == '__main__':
     import sys
 
     app = QtGui.QApplication(sys.argv)
-    main = Main()
+    main = Main(sys.argv[1] if len(sys.argv) > 1 else None)
     main.setWindowIcon(QtGui.QIcon('fypy logo wo Title-mod.ico'))
     main.show()
     sys.exit(app.exec_())
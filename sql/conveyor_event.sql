@@ -0,0 +1,19 @@
+-- Stroke event log for signal.sqlite. The trigger below adds one row per
+-- press stroke (each change to the conveyor "on" row, ID 1), so the
+-- connector needs no change: run this once against the signal database.
+-- SignalReader reads every row past the last ID it handled (saved in the
+-- shift cache across restarts), so strokes that happen between two checks,
+-- or while the collector is down, are all recorded, with their own times.
+-- Old rows may be pruned freely.
+
+CREATE TABLE IF NOT EXISTS conveyor_event (
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    stroke_datetime TIMESTAMP NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS conveyor_stroke
+AFTER UPDATE OF changed ON conveyor_signal
+WHEN NEW.ID = 1 AND NEW.changed IS NOT OLD.changed
+BEGIN
+    INSERT INTO conveyor_event (stroke_datetime) VALUES (NEW.changed);
+END;
@@ -0,0 +1,18 @@
+-- Hourly rollup of the press journals (smith_data.ROLLUP_TABLE): pieces
+-- per hour, station and defect code, code 0 being a good piece. It is off
+-- until switched on: run this script, fill in past hours with
+-- rebuild_rollup.py, then set the press's "rollup_table" in presses.json.
+-- From then on each cycle adds to it in the same transaction as its
+-- journal rows, so a missing table would stop journaling. Safe to run more
+-- than once.
+
+IF OBJECT_ID('dbo.prs457_hourly_rollup', 'U') IS NULL
+    CREATE TABLE dbo.prs457_hourly_rollup (
+        hour_start DATETIME NOT NULL,
+        station TINYINT NOT NULL,
+        defect_code TINYINT NOT NULL,
+        pieces INT NOT NULL,
+        CONSTRAINT PK_prs457_hourly_rollup
+            PRIMARY KEY (hour_start, station, defect_code)
+    );
+GO
@@ -0,0 +1,20 @@
+-- Supporting indexes for the dashboard's shift range query
+-- (smith_data.range_statement). Each covers the projected columns, so a
+-- shift reload is a single range seek on submit_datetime with no lookups.
+-- Safe to run more than once.
+
+IF NOT EXISTS (SELECT * FROM sys.indexes
+               WHERE name = 'IX_prs457_good_count_jnl_submit_datetime')
+    CREATE NONCLUSTERED INDEX IX_prs457_good_count_jnl_submit_datetime
+        ON dbo.prs457_good_count_jnl (submit_datetime)
+        INCLUDE (station_one, station_two, station_three, station_four,
+                 station_five, station_six, total_good);
+GO
+
+IF NOT EXISTS (SELECT * FROM sys.indexes
+               WHERE name = 'IX_prs457_defect_code_jnl_submit_datetime')
+    CREATE NONCLUSTERED INDEX IX_prs457_defect_code_jnl_submit_datetime
+        ON dbo.prs457_defect_code_jnl (submit_datetime)
+        INCLUDE (station_one, station_two, station_three, station_four,
+                 station_five, station_six);
+GO
@@ -0,0 +1,85 @@
+import os
+import sqlite3
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+        __file__))))
+
+import smith_data as sd
+from db_connection import ConnectionManager
+from press_simulation import create_journals
+
+
+class Server:
+    """
+    SQLite file standing in for the journal server, that can be taken down:
+    while down, new connections fail the way an unreachable server's do.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.up = True
+
+    def connect(self, *args, **kwargs):
+        if not self.up:
+            raise sqlite3.OperationalError('server unreachable')
+        return sqlite3.connect(*args, **kwargs)
+
+    def count(self, table):
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute("SELECT count(*) FROM " + table).fetchone()[0]
+        finally:
+            conn.close()
+
+    def insert(self, table, rows):
+        # Rows committed by another terminal.
+        conn = sqlite3.connect(self.path,
+                               detect_types=sqlite3.PARSE_DECLTYPES)
+        try:
+            conn.executemany(sd.insert_statement(table, self.columns[table]),
+                             rows)
+            conn.commit()
+        finally:
+            conn.close()
+
+
+@pytest.fixture
+def press():
+    return sd.Press('test', 'test_good_count_jnl', 'test_defect_code_jnl',
+                    sd.STATION_COLUMNS, 23, None)
+
+
+@pytest.fixture
+def server(tmp_path, press):
+    path = str(tmp_path / 'journal.sqlite')
+    conn = sqlite3.connect(path)
+    create_journals(conn, press)
+    conn.close()
+    server = Server(path)
+    server.columns = {table: press.columns(table)
+                      for table in (press.good_table, press.defect_table)}
+    return server
+
+
+@pytest.fixture
+def db(server):
+    db = ConnectionManager(server.connect, server.path, dialect='sqlite',
+                           min_backoff=0, max_backoff=0,
+                           detect_types=sqlite3.PARSE_DECLTYPES,
+                           check_same_thread=False)
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def wait_for():
+    # Polls until condition() holds, for results of the writer thread.
+    def wait(condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline, "timed out waiting."
+            time.sleep(.01)
+    return wait
@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+import numpy as np
+
+import smith_data as sd
+
+
+def cycles(shift_start, count, offset=0):
+    # count distinct cycles, as (prod_list, defect_list, submit_datetime).
+    return [([(cycle + station) % 2 for station in range(6)],
+             [(cycle * 7 + station) % 17 for station in range(6)],
+             shift_start + timedelta(seconds=offset + cycle))
+            for cycle in range(count)]
+
+
+def test_spill_rollback_unspill(tmp_path):
+    store = sd.ColumnStore(2, capacity=4)
+    values = np.arange(20, dtype=np.uint8).reshape(2, 10)
+    times = np.arange(10).astype('datetime64[s]')
+    store.extend(values, times)
+    store.spill(6, str(tmp_path))
+    assert (store.start, store.size, len(store)) == (6, 4, 10)
+
+    store.unspill(3)  # Back past the spilled cycles, then roll back.
+    store.truncate(3)
+    assert (store.start, len(store)) == (3, 3)
+    store.extend(values[:, 3:5] + 100, times[3:5])
+
+    kept, kept_times = store.cycles()
+    assert kept.tolist() == np.concatenate(
+            [values[:, :3], values[:, 3:5] + 100], axis=1).tolist()
+    assert kept_times.tolist() == times[:5].astype('datetime64[us]').tolist()
+    store.close()
+
+
+def test_spilled_shift_matches_unbounded(server, db, press, tmp_path):
+    data = sd.DataManager(db, press=press, hot_cycles=8,
+                          spill_dir=str(tmp_path))
+    data.finish_reconcile(wait=True)
+    shift_start = data.shift[0]
+    own = cycles(shift_start, 30, offset=100)
+    other = cycles(shift_start, 3, offset=1)
+    # Holding flush_lock keeps all 30 cycles pending while they spill.
+    with data.journal.flush_lock:
+        data.submit_cycles(own)
+        assert data.table_store(press.good_table).start > 0
+        server.insert(press.good_table,
+                      [prod + [sum(prod), when] for prod, _, when in other])
+        server.insert(press.defect_table,
+                      [defect + [when] for _, defect, when in other])
+        # Rolls back to the mark (cycle 0), through the spilled cycles.
+        data.apply_delta(data.fetch_delta())
+
+    reference = sd.DataManager(press=press, offline=True)
+    reference.record_cycles(other + own)
+    assert data.table_store(press.good_table).start > 0
+    for mine, theirs in zip(data.shift_state()[1:],
+                            reference.shift_state()[1:]):
+        assert np.array_equal(mine, theirs)
+    assert data.press_cycles() == reference.press_cycles() == 33
+    assert data.press_sum_prod() == reference.press_sum_prod()
+    assert data.top_defects() == reference.top_defects()
+    for station in range(1, 7):
+        assert data.station_mean(station) == reference.station_mean(station)
+        assert data.expand_average_series(station)[1][-1] == \
+            reference.expand_average_series(station)[1][-1]
+    data.close()
+    reference.close()
@@ -0,0 +1,55 @@
+from datetime import timedelta
+
+import smith_data as sd
+
+
+def start(db, press, **kwargs):
+    data = sd.DataManager(db, press=press, **kwargs)
+    data.finish_reconcile(wait=True)  # In case the first read is pending.
+    return data
+
+
+def test_apply_delta_keeps_pending_rows(server, db, press, wait_for):
+    data = start(db, press)
+    first = data.shift[0] + timedelta(seconds=1)
+    # Holding flush_lock keeps this terminal's cycles pending.
+    with data.journal.flush_lock:
+        data.submit_cycle([1, 1, 1, 1, 1, 0], [0, 0, 0, 0, 0, 3],
+                          first + timedelta(seconds=10))
+        data.submit_cycle([1, 1, 1, 1, 1, 1], [0] * 6,
+                          first + timedelta(seconds=11))
+        # Two cycles from another terminal reach the server meanwhile.
+        server.insert(press.good_table,
+                      [[0] * 6 + [0, first], [1] * 6 + [6, first]])
+        server.insert(press.defect_table,
+                      [[2] * 6 + [first], [0] * 6 + [first]])
+
+        assert data.apply_delta(data.fetch_delta()) == 4
+        assert data.press_cycles() == 4
+        assert data.press_sum_prod() == 17
+        assert data.top_three_defect(6)[0][:2] == [2, 3]
+        assert data.write_depth == 2
+
+    wait_for(lambda: data.write_depth == 0)
+    assert server.count(press.good_table) == 4
+    # Own rows now come back from the server instead of the writer, and
+    # are counted once.
+    assert data.apply_delta(data.fetch_delta()) == 4
+    assert data.press_cycles() == 4
+    assert data.press_sum_prod() == 17
+    assert data.apply_delta(data.fetch_delta()) == 0
+    assert data.press_cycles() == 4
+    data.close()
+
+
+def test_apply_delta_ignores_pending_rows_of_another_shift(server, db,
+                                                             press):
+    data = start(db, press)
+    with data.journal.flush_lock:
+        data.submit_cycle([1] * 6, [0] * 6,
+                          data.shift[0] - timedelta(minutes=1))
+        data.submit_cycle([1] * 6, [0] * 6,
+                          data.shift[0] + timedelta(minutes=1))
+        assert data.apply_delta(data.fetch_delta()) == 0
+        assert data.press_cycles() == 1
+    data.close()
@@ -0,0 +1,98 @@
+import sqlite3
+from datetime import datetime
+
+from journal_buffer import JournalBuffer, JournalWriter
+from press_simulation import create_journals
+from shift_cache import ShiftCache
+import smith_data as sd
+
+
+def cycle_rows(press, when, good=1, code=0):
+    # The (statement, row) pairs of one cycle, as DataManager builds them.
+    stations = press.stations
+    return [(sd.insert_statement(press.good_table,
+                                 press.columns(press.good_table)),
+             [good] * stations + [good * stations, when]),
+            (sd.insert_statement(press.defect_table,
+                                 press.columns(press.defect_table)),
+             [code] * stations + [when])]
+
+
+def test_failed_flush_is_retried(server, db, press):
+    buffer = JournalBuffer(db, max_batch=8)
+    buffer.add_cycle(cycle_rows(press, datetime.now()))
+
+    server.up = False
+    assert buffer.flush() == 0
+    assert buffer.last_error is not None
+    assert len(buffer) == 2  # Nothing dropped.
+    assert buffer.batch_limit == 8  # Backed off to a full batch.
+    assert buffer.quarantined == []  # Down, not rejected.
+    assert server.count(press.good_table) == 0
+
+    server.up = True
+    buffer.add_cycle(cycle_rows(press, datetime.now()))
+    assert buffer.flush() == 4
+    assert buffer.last_error is None
+    assert len(buffer) == 0
+    assert buffer.cycles == 0
+    assert buffer.batch_limit == buffer.max_cycles
+    assert server.count(press.good_table) == 2
+    assert server.count(press.defect_table) == 2
+
+
+def test_rejected_statement_is_quarantined(server, db, press):
+    buffer = JournalBuffer(db)
+    rows = cycle_rows(press, datetime.now())
+    buffer.add_cycle(rows + [("INSERT INTO missing_table VALUES (?)", [1])])
+
+    assert buffer.flush() == 0
+    assert [statement for statement, rows, error in buffer.quarantined] == \
+        ["INSERT INTO missing_table VALUES (?)"]
+    assert len(buffer) == 2  # The journal rows wait for the next flush.
+
+    assert buffer.flush() == 2
+    assert server.count(press.good_table) == 1
+
+
+def test_writer_spools_rows_it_could_not_write(server, db, press, tmp_path):
+    spool = ShiftCache(str(tmp_path / 'cache.sqlite'))
+    server.up = False
+    writer = JournalWriter(JournalBuffer(db), spool=spool)
+    writer.start()
+    for second in range(3):
+        assert writer.submit(cycle_rows(press, datetime(2024, 1, 1, 8, 0,
+                                                        second)))
+    assert writer.stop(timeout=5) == 6
+    assert len(spool.load_unsent()) == 6
+
+    server.up = True
+    writer = JournalWriter(JournalBuffer(db), spool=spool)
+    assert len(writer.pending_rows(cycle_rows(press, None)[0][0])) == 3
+    writer.start()
+    assert writer.stop(timeout=5) == 0
+    assert server.count(press.good_table) == 3
+    assert spool.load_unsent() == []
+    spool.close()
+
+
+def test_additive_rows_are_summed_per_key(server, db, press):
+    upsert = sd.ROLLUP_UPSERT['sqlite'].format('test_rollup')
+    conn = sqlite3.connect(server.path)
+    create_journals(conn, press._replace(rollup_table='test_rollup'))
+    conn.close()
+    hour = datetime(2024, 1, 1, 8)
+    buffer = JournalBuffer(db, max_cycles=3)
+    buffer.additive.add(upsert)
+    for code in (0, 3, 0):
+        buffer.add_cycle([(upsert, [hour, 1, code, 1]),
+                          (upsert, [hour, 2, 0, 1])])
+    assert JournalBuffer.sum_rows(buffer.rows(upsert)) == [
+        (hour, 1, 0, 2), (hour, 2, 0, 3), (hour, 1, 3, 1)]
+
+    assert buffer.flush() == 6
+    conn = sqlite3.connect(server.path)
+    assert conn.execute("SELECT station, defect_code, pieces FROM "
+                        "test_rollup ORDER BY station, defect_code"
+                        ).fetchall() == [(1, 0, 2), (1, 3, 1), (2, 0, 3)]
+    conn.close()
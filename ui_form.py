@@ -0,0 +1,68 @@
+"""
+The dashboard's Qt Designer form, compiled once. loadUiType parses and
+compiles ui/main.ui on every launch; load_form keeps the pyuic4 output as a
+module beside the .ui file (main.ui -> main_ui.py) and only compiles again
+when the .ui file's contents change, so a normal launch is one import.
+"""
+import hashlib
+import importlib.util
+import os
+import xml.etree.ElementTree as ElementTree
+from PyQt4 import QtGui, uic
+
+UI_PATH = 'ui/main.ui'
+HEADER = '# ui_sha1={0} form={1} base={2}\n'
+
+
+def ui_digest(ui_path):
+    with open(ui_path, 'rb') as ui_file:
+        return hashlib.sha1(ui_file.read()).hexdigest()
+
+
+def cached_header(form_path):
+    # (sha1, form class, base class) from a compiled form, or None.
+    try:
+        with open(form_path, encoding='utf-8') as form_file:
+            first = form_file.readline()
+    except OSError:
+        return None
+    if not first.startswith('# ui_sha1='):
+        return None
+    return tuple(field.split('=', 1)[1] for field in first.split()[1:])
+
+
+def compile_form(ui_path, form_path, digest):
+    """
+    Writes the pyuic4 module for a .ui file, with a header recording the
+    .ui file's hash and the class names load_form needs.
+    :return: (tuple): (sha1, form class, base class) names.
+    """
+    root = ElementTree.parse(ui_path).getroot()
+    form = 'Ui_' + root.find('class').text
+    base = root.find('widget').get('class')
+    temp_path = form_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as form_file:
+        form_file.write(HEADER.format(digest, form, base))
+        uic.compileUi(ui_path, form_file)
+    os.replace(temp_path, form_path)  # Never leaves half a module.
+    return digest, form, base
+
+
+def load_form(ui_path=UI_PATH):
+    """
+    :param ui_path: (Str): Qt Designer file.
+    :return: (tuple): (form class, Qt base class), as from loadUiType.
+    """
+    form_path = os.path.splitext(ui_path)[0] + '_ui.py'
+    digest = ui_digest(ui_path)
+    header = cached_header(form_path)
+    if header is None or header[0] != digest:
+        try:
+            header = compile_form(ui_path, form_path, digest)
+        except OSError:
+            return uic.loadUiType(ui_path)  # Read-only install.
+    spec = importlib.util.spec_from_file_location(
+        os.path.splitext(os.path.basename(form_path))[0], form_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, header[1]), getattr(QtGui, header[2])